@@ -1,12 +1,17 @@
+import hashlib
 import os
+import shutil
 import tempfile
 from typing import Optional
 
 from dotenv import load_dotenv
 from fastapi import Body, FastAPI, File, Form, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, ORJSONResponse
+from starlette.concurrency import run_in_threadpool
 
+from disk_cache import read_cache_entry, write_cache_entry
 from excel_export import generate_excel_from_api_response
 from excel_parser import (
     merge_all_data,
@@ -14,11 +19,19 @@ from excel_parser import (
     parse_manager_sheet,
     validate_bom_with_pdf,
 )
-from parser import parse_drawing_pdf_ai
+from parser import CLAUDE_MODEL, DRAWING_TABLES, parse_drawing_pdf_ai_async
 
 load_dotenv()
 
-app = FastAPI(title="PDF Parser API", version="2.0.0")
+# Ключ читается один раз при старте (после load_dotenv), а не на каждый запрос
+ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
+
+# ORJSONResponse: сериализация ответов через orjson (быстрее stdlib json)
+app = FastAPI(
+    title="PDF Parser API",
+    version="2.0.0",
+    default_response_class=ORJSONResponse,
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -27,6 +40,138 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Маршруты, ответы которых не сжимаются: .xlsx уже ZIP архив - повторное
+# сжатие тратит CPU и убирает Content-Length у FileResponse
+GZIP_EXCLUDED_PATHS = {"/api/export-excel"}
+
+
+class JSONGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware, пропускающий маршруты из GZIP_EXCLUDED_PATHS"""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in GZIP_EXCLUDED_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        await super().__call__(scope, receive, send)
+
+
+# Сжатие JSON ответов (клиенты распаковывают автоматически)
+app.add_middleware(JSONGZipMiddleware, minimum_size=1024)
+
+
+# Размер чанка при копировании загруженного файла на диск
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+
+# Кэш результатов парсинга PDF - основной уровень кэша для API (ключ -
+# SHA-256 содержимого PDF, модели и промптов, см. pdf_cache_key). Каталог,
+# TTL и размер общие с кэшем ответов Claude (см. disk_cache)
+# Версия формата результата: увеличивать при изменении схем ответа и
+# постобработки (промпты и модель входят в ключ сами)
+PDF_CACHE_VERSION = 2
+
+# Поля table1, по которым PDF сверяется с BOM
+VALIDATION_FIELDS = {"SIZE", "ASME", "ENDS"}
+
+
+class HashingReader:
+    """Обёртка над файлом: считает SHA-256 по мере чтения"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hasher = hashlib.sha256()
+
+    def read(self, size=-1):
+        chunk = self.fileobj.read(size)
+        self.hasher.update(chunk)
+        return chunk
+
+
+def claim_upload_sync(spooled, dest_path: str) -> str:
+    """Синхронная часть claim_upload (выполняется в threadpool)"""
+
+    spooled.seek(0)
+    reader = HashingReader(spooled)
+
+    with open(dest_path, "wb") as tmp:
+        shutil.copyfileobj(reader, tmp, UPLOAD_CHUNK_SIZE)
+
+    return reader.hasher.hexdigest()
+
+
+async def claim_upload(upload: UploadFile, dest_path: str) -> str:
+    """
+    Сохраняет загруженный файл на диск по пути dest_path
+
+    Файл копируется чанками (без чтения всего файла в память).
+    Забрать файл спула starlette без копирования нельзя: после сброса на
+    диск это безымянный TemporaryFile (O_TMPFILE | O_EXCL на Linux, сразу
+    удаленный файл на macOS), жесткую ссылку на него создать невозможно.
+    Выполняется в threadpool, чтобы не блокировать event loop.
+    Попутно считает SHA-256 содержимого.
+
+    Args:
+        upload: загруженный файл
+        dest_path: куда сохранить файл
+
+    Returns:
+        str: sha256 hex digest содержимого
+    """
+
+    return await run_in_threadpool(claim_upload_sync, upload.file, dest_path)
+
+
+def pdf_cache_key(digest: str) -> str:
+    """
+    Ключ кэша результата парсинга PDF
+
+    Результат зависит не только от PDF, но и от модели, промптов и схем
+    ответа - при их изменении старые записи не используются
+
+    Args:
+        digest: SHA-256 содержимого PDF
+
+    Returns:
+        hex digest
+    """
+
+    key = hashlib.sha256()
+
+    for part in (CLAUDE_MODEL, str(PDF_CACHE_VERSION), digest):
+        key.update(part.encode())
+        key.update(b"\0")
+
+    for table, (box, prompt, max_tokens, _) in DRAWING_TABLES.items():
+        key.update(f"{table}{box}{max_tokens}".encode())
+        key.update(prompt.encode())
+        key.update(b"\0")
+
+    return key.hexdigest()
+
+
+def get_cached_pdf_data(digest: str) -> Optional[dict]:
+    """
+    Возвращает закэшированный результат парсинга PDF или None
+
+    Args:
+        digest: SHA-256 содержимого PDF
+    """
+
+    return read_cache_entry(f"pdf_{pdf_cache_key(digest)}.json")
+
+
+def set_cached_pdf_data(digest: str, pdf_data: dict):
+    """
+    Сохраняет результат парсинга PDF в кэш и чистит кэш от просроченных
+    и лишних записей
+
+    Args:
+        digest: SHA-256 содержимого PDF
+        pdf_data: результат parse_drawing_pdf_ai
+    """
+
+    write_cache_entry(f"pdf_{pdf_cache_key(digest)}.json", pdf_data)
+
 
 @app.get("/")
 async def root():
@@ -54,7 +199,7 @@ async def export_excel(data: dict = Body(...)):
 
     try:
         # Генерируем Excel
-        excel_path = generate_excel_from_api_response(data)
+        excel_path = await run_in_threadpool(generate_excel_from_api_response, data)
 
         # Возвращаем файл
         return FileResponse(
@@ -119,58 +264,62 @@ async def parse_pdf(
         }
     """
 
-    # Сохраняем PDF
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as pdf_tmp:
-        pdf_content = await pdf_file.read()
-        pdf_tmp.write(pdf_content)
-        pdf_path = pdf_tmp.name
+    # Все временные файлы запроса - в одной директории:
+    # удаляется целиком при выходе, даже при ошибке на середине
+    with tempfile.TemporaryDirectory(prefix="pdf-parser-") as tmp_dir:
+        # Сохраняем PDF
+        pdf_path = os.path.join(tmp_dir, "drawing.pdf")
+        pdf_digest = await claim_upload(pdf_file, pdf_path)
 
-    bom_path = None
-    manager_path = None
+        bom_path = None
+        manager_path = None
 
-    # Сохраняем Excel файлы если предоставлены
-    if excel_bom:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as bom_tmp:
-            bom_content = await excel_bom.read()
-            bom_tmp.write(bom_content)
-            bom_path = bom_tmp.name
+        # Сохраняем Excel файлы если предоставлены
+        if excel_bom:
+            bom_path = os.path.join(tmp_dir, "bom.xlsx")
+            await claim_upload(excel_bom, bom_path)
 
-    if excel_manager:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx") as manager_tmp:
-            manager_content = await excel_manager.read()
-            manager_tmp.write(manager_content)
-            manager_path = manager_tmp.name
+        if excel_manager:
+            manager_path = os.path.join(tmp_dir, "manager.xlsx")
+            await claim_upload(excel_manager, manager_path)
 
-    try:
-        api_key = os.getenv("ANTHROPIC_API_KEY")
+        try:
+            api_key = ANTHROPIC_API_KEY
+
+            if not api_key:
+                return {"success": False, "error": "API ключ не найден"}
 
-        if not api_key:
-            return {"success": False, "error": "API ключ не найден"}
+            # ШАГ 1: Парсим PDF (повторная загрузка того же PDF - из кэша;
+            # файловый ввод-вывод кэша - в threadpool)
+            pdf_data = await run_in_threadpool(get_cached_pdf_data, pdf_digest)
 
-        # ШАГ 1: Парсим PDF
-        pdf_data = parse_drawing_pdf_ai(pdf_path, api_key)
+            if pdf_data is None:
+                pdf_data = await parse_drawing_pdf_ai_async(pdf_path, api_key)
+                await run_in_threadpool(set_cached_pdf_data, pdf_digest, pdf_data)
 
-        # Извлекаем SIZE, ASME, ENDS из table1
-        table1 = pdf_data.get("table1", [])
-        pdf_size = None
-        pdf_asme = None
-        pdf_ends = None
+            # Только PDF (без Excel) - сразу отдаём результат парсинга
+            if not (bom_path and manager_path):
+                return {"success": True, "data": pdf_data}
 
-        for item in table1:
-            if item.get("field") == "SIZE":
-                pdf_size = item.get("value")
-            elif item.get("field") == "ASME":
-                pdf_asme = item.get("value")
-            elif item.get("field") == "ENDS":
-                pdf_ends = item.get("value")
+            # ШАГ 2-7: Есть Excel файлы - обрабатываем
+
+            # Извлекаем SIZE, ASME, ENDS из table1 (один проход)
+            fields = {
+                item["field"]: item.get("value")
+                for item in pdf_data.get("table1", [])
+                if item.get("field") in VALIDATION_FIELDS
+            }
+            pdf_size = fields.get("SIZE")
+            pdf_asme = fields.get("ASME")
+            pdf_ends = fields.get("ENDS")
 
-        validation_info = {}
+            validation_info = {}
 
-        # ШАГ 2-7: Если есть Excel файлы - обрабатываем
-        if bom_path and manager_path:
             try:
                 # ШАГ 2: Парсим BOM
-                bom_data = parse_bom_sheet(bom_path, bom_sheet_index)
+                bom_data = await run_in_threadpool(
+                    parse_bom_sheet, bom_path, bom_sheet_index
+                )
 
                 # ШАГ 3: КРИТИЧЕСКАЯ ВАЛИДАЦИЯ
                 validation = validate_bom_with_pdf(
@@ -204,8 +353,11 @@ async def parse_pdf(
                 validation_info["bom_components"] = len(bom_data["components"])
 
                 # ШАГ 6: Парсим Manager
-                manager_data = parse_manager_sheet(
-                    manager_path, bom_data["size"], bom_data["asme"]
+                manager_data = await run_in_threadpool(
+                    parse_manager_sheet,
+                    manager_path,
+                    bom_data["size"],
+                    bom_data["asme"],
                 )
 
                 if manager_data["found"]:
@@ -216,8 +368,11 @@ async def parse_pdf(
                     )
 
                     # ШАГ 7: Объединяем всё
-                    pdf_data = merge_all_data(
-                        pdf_data, bom_data["components"], manager_data["materials"]
+                    pdf_data = await run_in_threadpool(
+                        merge_all_data,
+                        pdf_data,
+                        bom_data["components"],
+                        manager_data["materials"],
                     )
                 else:
                     validation_info["manager_found"] = False
@@ -229,23 +384,10 @@ async def parse_pdf(
                     "error": f"Ошибка обработки Excel: {str(excel_error)}",
                 }
 
-        response = {"success": True, "data": pdf_data}
-
-        if validation_info:
-            response["validation"] = validation_info
+            return {"success": True, "data": pdf_data, "validation": validation_info}
 
-        return response
-
-    except Exception as e:
-        return {"success": False, "error": str(e)}
-
-    finally:
-        # Удаляем временные файлы
-        os.unlink(pdf_path)
-        if bom_path:
-            os.unlink(bom_path)
-        if manager_path:
-            os.unlink(manager_path)
+        except Exception as e:
+            return {"success": False, "error": str(e)}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,112 @@
+"""
+Файловый кэш JSON результатов
+Один каталог и один бюджет (TTL + число записей) на два уровня кэша:
+
+- pdf_*.json (api.py) - результат парсинга PDF целиком. Основной уровень
+  для API: при попадании рендер и запросы к Claude не выполняются вовсе
+- claude_*.json (parser.py) - разобранный ответ Claude на одну таблицу.
+  Нужен там, где нет уровня PDF (CLI, sync-обёртки), и при частичном сбое:
+  если одна таблица упала, повторный запрос не платит за уже
+  распознанные. После записи pdf_* эти записи для API избыточны и
+  вытесняются общим бюджетом
+"""
+
+import os
+import tempfile
+import time
+
+import orjson
+
+CACHE_DIR = os.getenv(
+    "PDF_CACHE_DIR", os.path.join(tempfile.gettempdir(), "pdf-parser-cache")
+)
+CACHE_TTL = int(os.getenv("PDF_CACHE_TTL", 86400))  # секунды
+# Сколько записей (обоих уровней вместе) держать на диске; лишние и
+# просроченные удаляются при записи
+CACHE_MAX_ENTRIES = int(os.getenv("PDF_CACHE_MAX_ENTRIES", 1024))
+
+
+def read_cache_entry(name):
+    """
+    Возвращает содержимое записи кэша или None
+
+    Args:
+        name: имя файла записи ("pdf_<key>.json" / "claude_<key>.json")
+
+    Returns:
+        разобранный JSON или None (нет файла, запись просрочена или битая)
+    """
+
+    cache_path = os.path.join(CACHE_DIR, name)
+
+    try:
+        if time.time() - os.path.getmtime(cache_path) > CACHE_TTL:
+            return None
+
+        with open(cache_path, "rb") as f:
+            return orjson.loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def write_cache_entry(name, data):
+    """
+    Сохраняет запись кэша (атомарно через os.replace) и чистит кэш от
+    просроченных и лишних записей
+
+    Args:
+        name: имя файла записи ("pdf_<key>.json" / "claude_<key>.json")
+        data: JSON-сериализуемые данные
+    """
+
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+
+        with tempfile.NamedTemporaryFile(
+            "wb", dir=CACHE_DIR, suffix=".tmp", delete=False
+        ) as tmp:
+            tmp.write(orjson.dumps(data))
+
+        os.replace(tmp.name, os.path.join(CACHE_DIR, name))
+    except OSError:
+        # Кэш - только оптимизация, ошибки записи не ломают запрос
+        pass
+
+    prune_cache_dir(CACHE_DIR, CACHE_TTL, CACHE_MAX_ENTRIES)
+
+
+def prune_cache_dir(cache_dir, ttl, max_entries):
+    """
+    Удаляет из каталога кэша просроченные файлы и самые старые сверх
+    max_entries
+
+    Args:
+        cache_dir: каталог кэша (только файлы кэша)
+        ttl: время жизни записи в секундах
+        max_entries: сколько самых свежих записей оставить
+    """
+
+    now = time.time()
+    entries = []
+
+    try:
+        with os.scandir(cache_dir) as it:
+            for entry in it:
+                try:
+                    if entry.is_file():
+                        entries.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    continue
+    except OSError:
+        return
+
+    # Свежие первыми
+    entries.sort(reverse=True)
+
+    for index, (mtime, path) in enumerate(entries):
+        if index >= max_entries or now - mtime > ttl:
+            try:
+                os.remove(path)
+            except OSError:
+                # Уже удален параллельным запросом
+                pass
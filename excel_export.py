@@ -5,51 +5,134 @@ Excel Export Module
 """
 
 import os
+from collections import Counter
 from datetime import datetime
 
-import openpyxl
-from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+import xlsxwriter
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
 from openpyxl.utils import get_column_letter
 
-
-def auto_adjust_column_width(ws, min_width: int = 10, max_width: int = 50):
+# НОВОЕ: Только одна колонка Material (из PDF)!
+HEADERS = (
+    "Pos",
+    "Description",
+    "Material",  # ← ОДНА колонка! (из PDF - истина)
+    "Quantity",
+    "Manager Quantity",  # ← Добавляем если есть
+    "Status",
+    "Note",
+)
+
+# Ширина колонок отчёта по заголовку (структура отчёта фиксирована)
+# Pos шире, чем нужно для номера - в колонке A же подписи статистики и легенды
+COLUMN_WIDTHS = {
+    "Pos": 18,
+    "Description": 42,
+    "Material": 32,
+    "Quantity": 10,
+    "Manager Quantity": 16,
+    "Status": 14,
+    "Note": 40,
+}
+
+# Цвета для статусов
+COLOR_EQUAL = "C6EFCE"  # Светло-зелёный
+COLOR_NOT_EQUAL = "FFC7CE"  # Светло-красный
+COLOR_NEW_ITEM = "FFEB9C"  # Светло-жёлтый
+COLOR_HEADER = "4472C4"  # Синий
+
+# Текст колонки Status и цвет строки по статусу
+STATUS_TEXT = {
+    "equal": "✅ Equal",
+    "notEqual": "❌ Not Equal",
+    "new": "🆕 New Item",
+}
+
+STATUS_COLORS = {
+    "equal": COLOR_EQUAL,
+    "notEqual": COLOR_NOT_EQUAL,
+    "new": COLOR_NEW_ITEM,
+}
+
+# Стили openpyxl (неизменяемые - общие для всех генерируемых книг)
+HEADER_FILL = PatternFill(
+    start_color=COLOR_HEADER, end_color=COLOR_HEADER, fill_type="solid"
+)
+HEADER_FONT = Font(bold=True, color="FFFFFF", size=11)
+
+STATUS_FILLS = {
+    status: PatternFill(start_color=color, end_color=color, fill_type="solid")
+    for status, color in STATUS_COLORS.items()
+}
+
+THIN_BORDER = Border(
+    left=Side(style="thin", color="000000"),
+    right=Side(style="thin", color="000000"),
+    top=Side(style="thin", color="000000"),
+    bottom=Side(style="thin", color="000000"),
+)
+
+CENTER_ALIGNMENT = Alignment(horizontal="center", vertical="center")
+LEFT_ALIGNMENT = Alignment(horizontal="left", vertical="center")
+
+# Именованный стиль строки данных по статусу
+ROW_STYLES = {
+    "equal": "equal_row",
+    "notEqual": "not_equal_row",
+    "new": "new_item_row",
+}
+
+# С этого числа компонентов отчёт пишется через xlsxwriter
+XLSXWRITER_MIN_ROWS = 100
+
+
+def report_row(component: dict) -> tuple:
     """
-    Автоматически подстраивает ширину колонок под содержимое
+    Формирует значения строки отчёта для компонента
 
     Args:
-        ws: worksheet
-        min_width: минимальная ширина колонки
-        max_width: максимальная ширина колонки
-    """
-
-    for column in ws.columns:
-        max_length = 0
-        column_letter = None
-
-        for cell in column:
-            # Пропускаем merged cells
-            if isinstance(cell, openpyxl.cell.cell.MergedCell):
-                continue
+        component: элемент table2
 
-            column_letter = cell.column_letter
-
-            try:
-                # Вычисляем длину текста в ячейке
-                if cell.value:
-                    cell_value = str(cell.value)
-                    # Учитываем переносы строк
-                    lines = cell_value.split("\n")
-                    current_max = max(len(line) for line in lines)
+    Returns:
+        (row_data, status) - значения колонок HEADERS и исходный статус
+    """
 
-                    if current_max > max_length:
-                        max_length = current_max
-            except:
-                pass
+    pos = component.get("pos", "-")
+    description = component.get("description", "")
+
+    # НОВОЕ: material теперь строка (не объект!)
+    material = component.get("material", "-")
+    if not material or material == "":
+        material = "-"
+
+    quantity = component.get("quantity", "-")
+    if quantity is None or quantity == "":
+        quantity = "-"
+
+    manager_quantity = component.get("manager_quantity", "-")
+    if manager_quantity is None or manager_quantity == "":
+        manager_quantity = "-"
+
+    status = component.get("status", "-")
+    note = component.get("note", "-")
+
+    # Текст статуса (неизвестный статус выводится как есть)
+    status_text = STATUS_TEXT.get(status, status)
+
+    # Заполняем строку
+    row_data = [
+        pos,
+        description,
+        material,  # ← Всегда из PDF (истина!)
+        quantity,
+        manager_quantity,
+        status_text,
+        note,
+    ]
 
-        # Устанавливаем ширину с учетом границ
-        if column_letter:
-            adjusted_width = min(max(max_length + 2, min_width), max_width)
-            ws.column_dimensions[column_letter].width = adjusted_width
+    return row_data, status
 
 
 def generate_excel_report(data: dict, output_path: str = None) -> str:
@@ -61,6 +144,9 @@ def generate_excel_report(data: dict, output_path: str = None) -> str:
     - Status: equal / notEqual / new
     - Цветовая индикация по статусу
 
+    Большие отчёты (от XLSXWRITER_MIN_ROWS компонентов) пишутся через
+    xlsxwriter, маленькие - через openpyxl (у xlsxwriter дороже старт).
+
     Args:
         data: результат парсинга (table1, table2, table3)
         output_path: путь для сохранения (если None - создаёт временный)
@@ -69,64 +155,114 @@ def generate_excel_report(data: dict, output_path: str = None) -> str:
         str: путь к созданному файлу
     """
 
-    # Создаём новую книгу
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Parsing Results"
+    if output_path is None:
+        output_path = (
+            f"/tmp/parsing_result_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+        )
 
-    # Цвета для статусов
-    COLOR_EQUAL = "C6EFCE"  # Светло-зелёный
-    COLOR_NOT_EQUAL = "FFC7CE"  # Светло-красный
-    COLOR_NEW_ITEM = "FFEB9C"  # Светло-жёлтый
-    COLOR_HEADER = "4472C4"  # Синий
+    if len(data.get("table2", [])) >= XLSXWRITER_MIN_ROWS:
+        return generate_with_xlsxwriter(data, output_path)
 
-    # Стили
-    header_fill = PatternFill(
-        start_color=COLOR_HEADER, end_color=COLOR_HEADER, fill_type="solid"
-    )
-    header_font = Font(bold=True, color="FFFFFF", size=11)
+    return generate_with_openpyxl(data, output_path)
 
-    equal_fill = PatternFill(
-        start_color=COLOR_EQUAL, end_color=COLOR_EQUAL, fill_type="solid"
-    )
-    not_equal_fill = PatternFill(
-        start_color=COLOR_NOT_EQUAL, end_color=COLOR_NOT_EQUAL, fill_type="solid"
-    )
-    new_item_fill = PatternFill(
-        start_color=COLOR_NEW_ITEM, end_color=COLOR_NEW_ITEM, fill_type="solid"
-    )
 
-    border = Border(
-        left=Side(style="thin", color="000000"),
-        right=Side(style="thin", color="000000"),
-        top=Side(style="thin", color="000000"),
-        bottom=Side(style="thin", color="000000"),
-    )
+def generate_with_openpyxl(data: dict, output_path: str) -> str:
+    """
+    Генерирует Excel отчёт через openpyxl
+
+    Книга создаётся в режиме write_only: строки пишутся потоком,
+    без построения всей сетки ячеек в памяти.
 
-    center_alignment = Alignment(horizontal="center", vertical="center")
-    left_alignment = Alignment(horizontal="left", vertical="center")
+    Args:
+        data: результат парсинга (table1, table2, table3)
+        output_path: путь для сохранения
+
+    Returns:
+        str: путь к созданному файлу
+    """
+
+    # Создаём новую книгу (потоковая запись)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Parsing Results")
+
+    bold_font = Font(bold=True)
+
+    # Именованные стили: регистрируются в книге один раз, ячейке
+    # назначается только имя стиля (один общий styleId в XML)
+    named_styles = [
+        ("header_row", HEADER_FONT, HEADER_FILL, CENTER_ALIGNMENT),
+        ("data_row", Font(), PatternFill(), LEFT_ALIGNMENT),
+    ] + [
+        (ROW_STYLES[status], Font(), fill, LEFT_ALIGNMENT)
+        for status, fill in STATUS_FILLS.items()
+    ]
+
+    for name, font, fill, alignment in named_styles:
+        named_style = NamedStyle(name=name)
+        named_style.font = font
+        named_style.fill = fill
+        named_style.border = THIN_BORDER
+        named_style.alignment = alignment
+        wb.add_named_style(named_style)
+
+    def make_cell(value, style=None, font=None, fill=None, border=None, alignment=None):
+        cell = WriteOnlyCell(ws, value=value)
+        if style:
+            cell.style = style
+        if font:
+            cell.font = font
+        if fill:
+            cell.fill = fill
+        if border:
+            cell.border = border
+        if alignment:
+            cell.alignment = alignment
+        return cell
+
+    # ========== ШИРИНА КОЛОНОК ==========
+    # В write_only режиме размеры колонок задаются ДО записи строк
+    for col_idx, header in enumerate(HEADERS, start=1):
+        ws.column_dimensions[get_column_letter(col_idx)].width = COLUMN_WIDTHS.get(
+            header, 15
+        )
 
     # ========== ЗАГОЛОВОК ==========
-    ws.merge_cells("A1:G1")
-    ws["A1"] = "PDF PARSING RESULTS"
-    ws["A1"].font = Font(bold=True, size=16)
-    ws["A1"].alignment = center_alignment
+    ws.append(
+        [
+            make_cell(
+                "PDF PARSING RESULTS",
+                font=Font(bold=True, size=16),
+                alignment=CENTER_ALIGNMENT,
+            )
+        ]
+    )
+    ws.merged_cells.ranges.add("A1:G1")
+
+    ws.append(
+        [
+            make_cell(
+                f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+                font=Font(size=10, italic=True),
+                alignment=CENTER_ALIGNMENT,
+            )
+        ]
+    )
+    ws.merged_cells.ranges.add("A2:G2")
 
-    ws.merge_cells("A2:G2")
-    ws["A2"] = f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-    ws["A2"].font = Font(size=10, italic=True)
-    ws["A2"].alignment = center_alignment
+    ws.append([])
 
     # ========== СТАТИСТИКА ==========
     table2 = data.get("table2", [])
 
+    # Один проход по table2 вместо отдельного прохода на каждый статус
+    status_counts = Counter(c.get("status") for c in table2)
+
     total = len(table2)
-    equal = len([c for c in table2 if c.get("status") == "equal"])
-    not_equal = len([c for c in table2 if c.get("status") == "notEqual"])
-    new_items = len([c for c in table2 if c.get("status") == "new"])
+    equal = status_counts["equal"]
+    not_equal = status_counts["notEqual"]
+    new_items = status_counts["new"]
 
-    ws["A4"] = "STATISTICS:"
-    ws["A4"].font = Font(bold=True, size=12)
+    ws.append([make_cell("STATISTICS:", font=Font(bold=True, size=12))])
 
     stats_data = [
         ("Total Components:", total),
@@ -135,125 +271,187 @@ def generate_excel_report(data: dict, output_path: str = None) -> str:
         ("🆕 New Items:", new_items),
     ]
 
-    for idx, (label, value) in enumerate(stats_data, start=5):
-        ws[f"A{idx}"] = label
-        ws[f"B{idx}"] = value
-        ws[f"A{idx}"].font = Font(bold=True)
+    for label, value in stats_data:
+        ws.append([make_cell(label, font=bold_font), value])
+
+    ws.append([])
 
     # ========== ТАБЛИЦА ЗАГОЛОВКИ ==========
-    # НОВОЕ: Только одна колонка Material (из PDF)!
-    headers = [
-        "Pos",
-        "Description",
-        "Material",  # ← ОДНА колонка! (из PDF - истина)
-        "Quantity",
-        "Manager Quantity",  # ← Добавляем если есть
-        "Status",
-        "Note",
+    ws.append([make_cell(header, style="header_row") for header in HEADERS])
+
+    # ========== ДАННЫЕ ==========
+    for component in table2:
+        row_data, status = report_row(component)
+        row_style = ROW_STYLES.get(status, "data_row")
+
+        row_cells = [make_cell(value, style=row_style) for value in row_data]
+
+        # Pos - по центру, остальное - слева (из стиля)
+        row_cells[0].alignment = CENTER_ALIGNMENT
+
+        ws.append(row_cells)
+
+    # ========== ЛЕГЕНДА ==========
+    ws.append([])
+    ws.append([])
+
+    ws.append([make_cell("LEGEND:", font=Font(bold=True, size=11))])
+
+    legend_data = [
+        ("✅ Equal", "Materials match (smart comparison)", STATUS_FILLS["equal"]),
+        ("❌ Not Equal", "Materials do not match", STATUS_FILLS["notEqual"]),
+        ("🆕 New Item", "Found only in Manager Excel", STATUS_FILLS["new"]),
     ]
-    header_row = 10
 
-    for col_idx, header in enumerate(headers, start=1):
-        cell = ws.cell(row=header_row, column=col_idx)
-        cell.value = header
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = center_alignment
-        cell.border = border
+    for icon, description, fill in legend_data:
+        ws.append(
+            [
+                make_cell(icon, fill=fill, border=THIN_BORDER),
+                make_cell(description, border=THIN_BORDER),
+            ]
+        )
 
-    # ========== ДАННЫЕ ==========
-    current_row = header_row + 1
+    # ========== СОХРАНЕНИЕ ==========
+    wb.save(output_path)
 
-    for component in table2:
-        pos = component.get("pos", "-")
-        description = component.get("description", "")
-
-        # НОВОЕ: material теперь строка (не объект!)
-        material = component.get("material", "-")
-        if not material or material == "":
-            material = "-"
-
-        quantity = component.get("quantity", "-")
-        if quantity is None or quantity == "":
-            quantity = "-"
-
-        manager_quantity = component.get("manager_quantity", "-")
-        if manager_quantity is None or manager_quantity == "":
-            manager_quantity = "-"
-
-        status = component.get("status", "-")
-        note = component.get("note", "-")
-
-        # Определяем цветовой фон по статусу
-        if status == "new":
-            status_text = "🆕 New Item"
-            row_fill = new_item_fill
-        elif status == "notEqual":
-            status_text = "❌ Not Equal"
-            row_fill = not_equal_fill
-        elif status == "equal":
-            status_text = "✅ Equal"
-            row_fill = equal_fill
-        else:
-            status_text = status
-            row_fill = None
-
-        # Заполняем строку
-        row_data = [
-            pos,
-            description,
-            material,  # ← Всегда из PDF (истина!)
-            quantity,
-            manager_quantity,
-            status_text,
-            note,
-        ]
+    return output_path
 
-        for col_idx, value in enumerate(row_data, start=1):
-            cell = ws.cell(row=current_row, column=col_idx)
-            cell.value = value
-            cell.border = border
 
-            if col_idx == 1:  # Pos
-                cell.alignment = center_alignment
-            else:
-                cell.alignment = left_alignment
+def generate_with_xlsxwriter(data: dict, output_path: str) -> str:
+    """
+    Генерирует Excel отчёт через xlsxwriter (для больших BOM)
+
+    constant_memory: строки сбрасываются на диск по мере записи,
+    форматы создаются один раз, строка пишется одним write_row.
+    Раскладка листа та же, что в generate_with_openpyxl.
+
+    Args:
+        data: результат парсинга (table1, table2, table3)
+        output_path: путь для сохранения
+
+    Returns:
+        str: путь к созданному файлу
+    """
+
+    wb = xlsxwriter.Workbook(
+        output_path,
+        {
+            "constant_memory": True,
+            # Значения из PDF пишем как есть (без формул и ссылок)
+            "strings_to_formulas": False,
+            "strings_to_urls": False,
+        },
+    )
+    ws = wb.add_worksheet("Parsing Results")
+
+    # Форматы (создаются один раз)
+    border = {"border": 1, "border_color": "#000000"}
+    row_base = {**border, "align": "left", "valign": "vcenter"}
+
+    title_format = wb.add_format({"bold": True, "font_size": 16, "align": "center"})
+    generated_format = wb.add_format(
+        {"italic": True, "font_size": 10, "align": "center"}
+    )
+    bold_format = wb.add_format({"bold": True})
+    section_format = wb.add_format({"bold": True, "font_size": 12})
+    legend_title_format = wb.add_format({"bold": True, "font_size": 11})
+    header_format = wb.add_format(
+        {
+            **border,
+            "bold": True,
+            "font_color": "#FFFFFF",
+            "bg_color": f"#{COLOR_HEADER}",
+            "align": "center",
+            "valign": "vcenter",
+        }
+    )
+
+    # status -> (формат строки, формат Pos)
+    row_formats = {
+        status: (
+            wb.add_format({**row_base, "bg_color": f"#{color}"}),
+            wb.add_format({**row_base, "bg_color": f"#{color}", "align": "center"}),
+        )
+        for status, color in STATUS_COLORS.items()
+    }
+    default_formats = (
+        wb.add_format(row_base),
+        wb.add_format({**row_base, "align": "center"}),
+    )
+
+    # status -> формат иконки в легенде
+    legend_formats = {
+        status: wb.add_format({**border, "bg_color": f"#{color}"})
+        for status, color in STATUS_COLORS.items()
+    }
+    legend_border_format = wb.add_format(border)
+
+    # ========== ШИРИНА КОЛОНОК ==========
+    for col_idx, header in enumerate(HEADERS):
+        ws.set_column(col_idx, col_idx, COLUMN_WIDTHS.get(header, 15))
+
+    # ========== ЗАГОЛОВОК ==========
+    last_col = len(HEADERS) - 1
+    ws.merge_range(0, 0, 0, last_col, "PDF PARSING RESULTS", title_format)
+    ws.merge_range(
+        1,
+        0,
+        1,
+        last_col,
+        f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+        generated_format,
+    )
+
+    # ========== СТАТИСТИКА ==========
+    table2 = data.get("table2", [])
+    status_counts = Counter(c.get("status") for c in table2)
+
+    ws.write(3, 0, "STATISTICS:", section_format)
+
+    stats_data = [
+        ("Total Components:", len(table2)),
+        ("✅ Equal:", status_counts["equal"]),
+        ("❌ Not Equal:", status_counts["notEqual"]),
+        ("🆕 New Items:", status_counts["new"]),
+    ]
+
+    for row_idx, (label, value) in enumerate(stats_data, start=4):
+        ws.write(row_idx, 0, label, bold_format)
+        ws.write(row_idx, 1, value)
 
-            # Применяем цветовой фон
-            if row_fill:
-                cell.fill = row_fill
+    # ========== ТАБЛИЦА ==========
+    header_row = 9
+    ws.write_row(header_row, 0, HEADERS, header_format)
+
+    current_row = header_row + 1
+
+    for component in table2:
+        row_data, status = report_row(component)
+        row_format, pos_format = row_formats.get(status, default_formats)
+
+        ws.write(current_row, 0, row_data[0], pos_format)
+        ws.write_row(current_row, 1, row_data[1:], row_format)
 
         current_row += 1
 
     # ========== ЛЕГЕНДА ==========
     legend_row = current_row + 2
 
-    ws[f"A{legend_row}"] = "LEGEND:"
-    ws[f"A{legend_row}"].font = Font(bold=True, size=11)
+    ws.write(legend_row, 0, "LEGEND:", legend_title_format)
 
     legend_data = [
-        ("✅ Equal", "Materials match (smart comparison)", equal_fill),
-        ("❌ Not Equal", "Materials do not match", not_equal_fill),
-        ("🆕 New Item", "Found only in Manager Excel", new_item_fill),
+        ("✅ Equal", "Materials match (smart comparison)", "equal"),
+        ("❌ Not Equal", "Materials do not match", "notEqual"),
+        ("🆕 New Item", "Found only in Manager Excel", "new"),
     ]
 
-    for idx, (icon, description, fill) in enumerate(legend_data, start=legend_row + 1):
-        ws[f"A{idx}"] = icon
-        ws[f"B{idx}"] = description
-        ws[f"A{idx}"].fill = fill
-        ws[f"A{idx}"].border = border
-        ws[f"B{idx}"].border = border
-
-    # ========== ШИРИНА КОЛОНОК (автоматическая) ==========
-    auto_adjust_column_width(ws, min_width=8, max_width=50)
+    for row_idx, (icon, description, status) in enumerate(
+        legend_data, start=legend_row + 1
+    ):
+        ws.write(row_idx, 0, icon, legend_formats[status])
+        ws.write(row_idx, 1, description, legend_border_format)
 
-    # ========== СОХРАНЕНИЕ ==========
-    if output_path is None:
-        output_path = (
-            f"/tmp/parsing_result_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        )
-
-    wb.save(output_path)
+    wb.close()
 
     return output_path
 
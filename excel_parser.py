@@ -1,79 +1,380 @@
-import openpyxl
-from fuzzywuzzy import fuzz
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from python_calamine import CalamineWorkbook
+from rapidfuzz import fuzz, process, utils
 
 from hybrid_compare import smart_material_match
 
+logger = logging.getLogger(__name__)
+
+# ========== Чтение листов (calamine) + кэш ==========
+
+# Один и тот же BOM/Manager приходит в API повторно (новый temp файл на каждый
+# запрос), поэтому ключ кэша - SHA-256 содержимого, а не путь/mtime
+SHEET_CACHE_SIZE = 8
+SHEET_CACHE = OrderedDict()
+SHEET_CACHE_LOCK = threading.Lock()  # парсинг Excel идет в threadpool API
+
 
-def find_best_component_match(pdf_description, bom_components):
+def file_digest(filepath):
     """
-    Находит лучшее совпадение компонента из BOM для PDF компонента
+    Считает SHA-256 файла блоками по 1 MiB
 
-    ПРАВИЛЬНАЯ ЛОГИКА С ПРИОРИТЕТАМИ:
-    1. Точное совпадение (case-insensitive)
-    2. Все слова из PDF есть в BOM (токенизация)
-    3. Fuzzy matching с высоким порогом (только если ничего не нашли)
+    Args:
+        filepath: путь к файлу
+
+    Returns:
+        hex digest
+    """
+
+    digest = hashlib.sha256()
+
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def cell_value(value):
+    """
+    Приводит значение ячейки calamine к виду openpyxl
+
+    calamine отдает пустые ячейки как "" и все числа как float, а парсинг
+    ниже рассчитан на None и int (иначе size "12" превратится в "12.0")
 
     Args:
-        pdf_description: название компонента из PDF
-        bom_components: dict с компонентами BOM {name: {material, quantity}}
+        value: значение из CalamineSheet.to_python()
 
     Returns:
-        (bom_name, bom_data, match_type) или (None, None, None)
+        None для пустой ячейки, int для целого числа, иначе value
+    """
+
+    if value == "":
+        return None
+
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+
+    return value
+
+
+def read_sheet_rows(filepath, sheet_index, min_row, max_row, max_col, min_col=1):
+    """
+    Читает значения диапазона листа (с кэшем по содержимому файла)
+
+    Лист читается calamine (Rust) - в разы быстрее openpyxl. Повторный вызов
+    для того же файла вообще не открывает книгу
+
+    Args:
+        filepath: путь к .xlsx
+        sheet_index: индекс листа
+        min_row, max_row, max_col, min_col: границы диапазона (1-based,
+            как в Excel)
+
+    Returns:
+        tuple строк (tuple значений колонок min_col..max_col), начиная с min_row
+    """
+
+    key = (file_digest(filepath), sheet_index, min_row, max_row, min_col, max_col)
+
+    with SHEET_CACHE_LOCK:
+        rows = SHEET_CACHE.get(key)
+        if rows is not None:
+            SHEET_CACHE.move_to_end(key)
+            return rows
+
+    with CalamineWorkbook.from_path(filepath) as wb:
+        ws = wb.get_sheet_by_index(sheet_index)
+
+        # skip_empty_area=False: строки и колонки считаются от A1;
+        # nrows: дальше max_row лист не читаем
+        values = ws.to_python(skip_empty_area=False, nrows=max_row)
+
+    # Дополняем строки до max_col (как iter_rows с max_col) и отрезаем
+    # колонки левее min_col - лишние значения не конвертируем и не храним
+    padding = [""] * max_col
+    rows = tuple(
+        tuple(cell_value(value) for value in (row + padding)[min_col - 1 : max_col])
+        for row in values[min_row - 1 :]
+    )
+
+    with SHEET_CACHE_LOCK:
+        SHEET_CACHE[key] = rows
+        while len(SHEET_CACHE) > SHEET_CACHE_SIZE:
+            SHEET_CACHE.popitem(last=False)
+
+    return rows
+
+
+@dataclass
+class KeyIndex:
+    """
+    Предвычисленные ключи BOM/Manager для сопоставления с описаниями PDF
+
+    Хранится по колонкам (параллельные списки): поиск возвращает индекс,
+    по которому берутся и ключ, и значение - без обращений к исходному dict
+
+    Attributes:
+        names: исходные ключи
+        values: значения (данные компонента BOM / материал Manager)
+        exact: {key.lower().strip(): index} - точное совпадение за O(1)
+        words: множество слов каждого ключа
+        processed: ключи после utils.default_process (tuple - ключ кэша fuzzy)
+    """
+
+    names: list
+    values: list
+    exact: dict
+    words: list
+    processed: tuple
+
+
+def prepare_keys(mapping):
+    """
+    Строит KeyIndex по ключам BOM/Manager
+
+    Ключи фиксированы на весь вызов merge_all_data, поэтому lower(), разбиение
+    на слова и предобработка для fuzzy делаются один раз, а не для каждой
+    строки PDF
+
+    Args:
+        mapping: dict {name: ...} (компоненты BOM или материалы Manager)
+
+    Returns:
+        KeyIndex
+    """
+
+    names = list(mapping)
+    values = list(mapping.values())
+    exact = {}
+    words = []
+
+    for index, name in enumerate(names):
+        lower = name.lower().strip()
+        exact.setdefault(lower, index)  # при дублях побеждает первый, как в цикле
+        words.append(set(lower.replace("/", " ").replace("-", " ").split()))
+
+    processed = tuple(utils.default_process(name) for name in names)
+
+    return KeyIndex(names, values, exact, words, processed)
+
+
+# Порог fuzzy совпадения 85: rapidfuzz отдает float, а fuzzywuzzy сравнивал
+# округленный score, поэтому граница 84.5
+FUZZY_SCORE_CUTOFF = 84.5
+
+# Кэш fuzzy поиска: описания ("Body", "Ball", ...) повторяются между
+# запросами, а ключи BOM/Manager - между загрузками того же файла, поэтому
+# результат cdist запоминается по (описание, ключи)
+FUZZY_CACHE_SIZE = 4096
+FUZZY_CACHE = OrderedDict()
+FUZZY_CACHE_LOCK = threading.Lock()  # merge_all_data идет в threadpool API
+
+
+def best_fuzzy_keys(queries, choices):
     """
+    Fuzzy поиск лучшего ключа для каждого описания (с кэшем)
+
+    Уже встречавшиеся пары (описание, ключи) берутся из FUZZY_CACHE,
+    остальные описания считаются одним вызовом process.cdist
+    (матрица описания × ключи) вместо extractOne на каждую строку PDF
 
-    pdf_lower = pdf_description.lower().strip()
+    Args:
+        queries: описания после utils.default_process
+        choices: tuple ключей после utils.default_process (KeyIndex.processed)
+
+    Returns:
+        list (index, score) лучшего ключа или (None, 0) если score < 85
+    """
+
+    results = {}
+
+    with FUZZY_CACHE_LOCK:
+        for query in queries:
+            result = FUZZY_CACHE.get((query, choices))
+            if result is not None:
+                FUZZY_CACHE.move_to_end((query, choices))
+                results[query] = result
+
+    misses = [query for query in dict.fromkeys(queries) if query not in results]
+
+    if misses and choices:
+        # float64: те же значения score, что у extractOne
+        scores = process.cdist(
+            misses,
+            choices,
+            scorer=fuzz.token_sort_ratio,
+            processor=None,
+            score_cutoff=FUZZY_SCORE_CUTOFF,
+            dtype="float64",
+        )
+
+        for query, row in zip(misses, scores):
+            index = int(row.argmax())  # при равных score - первый ключ
+
+            if row[index] >= FUZZY_SCORE_CUTOFF:
+                results[query] = (index, round(row[index]))
+            else:
+                results[query] = (None, 0)
+
+        with FUZZY_CACHE_LOCK:
+            for query in misses:
+                FUZZY_CACHE[(query, choices)] = results[query]
+            while len(FUZZY_CACHE) > FUZZY_CACHE_SIZE:
+                FUZZY_CACHE.popitem(last=False)
+
+    return [results.get(query, (None, 0)) for query in queries]
+
+
+def best_fuzzy_key(query, choices):
+    """
+    Fuzzy поиск лучшего ключа для одного описания (см. best_fuzzy_keys)
+
+    Returns:
+        (index, score) лучшего ключа или (None, 0) если score < 85
+    """
+
+    return best_fuzzy_keys([query], choices)[0]
+
+
+def match_key_words(pdf_lower, keys):
+    """
+    Приоритеты 1-2 поиска ключа BOM/Manager (без fuzzy)
+
+    Args:
+        pdf_lower: название компонента из PDF (lower().strip())
+        keys: KeyIndex компонентов BOM или колонок Manager
+
+    Returns:
+        (index в keys, "exact" | "word_match") или (None, None)
+    """
 
     # ===== ПРИОРИТЕТ 1: ТОЧНОЕ СОВПАДЕНИЕ =====
-    for bom_name, bom_data in bom_components.items():
-        bom_lower = bom_name.lower().strip()
+    index = keys.exact.get(pdf_lower)
 
-        if pdf_lower == bom_lower:
-            return (bom_name, bom_data, "exact")
+    if index is not None:
+        return (index, "exact")
 
-    # ===== ПРИОРИТЕТ 2: ВСЕ СЛОВА PDF ЕСТЬ В BOM =====
-    # Проверяем что все значимые слова из PDF присутствуют в BOM
+    # ===== ПРИОРИТЕТ 2: ВСЕ СЛОВА PDF ЕСТЬ В КЛЮЧЕ BOM/MANAGER =====
+    # Проверяем что все значимые слова из PDF присутствуют в ключе
     # Например: "Operator Flange" → все слова есть в "Gland/operator Flange Screw"
 
     pdf_words = set(pdf_lower.replace("/", " ").replace("-", " ").split())
 
     word_matches = []
 
-    for bom_name, bom_data in bom_components.items():
-        bom_lower = bom_name.lower().strip()
-        bom_words = set(bom_lower.replace("/", " ").replace("-", " ").split())
-
-        # Все слова из PDF есть в BOM?
-        if pdf_words.issubset(bom_words):
+    for index, key_words in enumerate(keys.words):
+        # Все слова из PDF есть в ключе?
+        if pdf_words.issubset(key_words):
             # Чем меньше разница - тем точнее совпадение
-            extra_words = len(bom_words - pdf_words)
-            word_matches.append((bom_name, bom_data, extra_words))
+            extra_words = len(key_words - pdf_words)
+            word_matches.append((index, extra_words))
 
     # Если нашли - выбираем с минимумом лишних слов
     if word_matches:
-        word_matches.sort(key=lambda x: x[2])
-        bom_name, bom_data, _ = word_matches[0]
-        return (bom_name, bom_data, "word_match")
+        word_matches.sort(key=lambda x: x[1])
+        return (word_matches[0][0], "word_match")
+
+    return (None, None)
+
+
+def match_descriptions(descriptions, keys):
+    """
+    Сопоставляет все описания PDF с ключами BOM или Manager одним пакетом
+
+    Каждое уникальное описание ищется один раз. Приоритеты:
+    1. Точное совпадение (case-insensitive)
+    2. Все слова из PDF есть в ключе (токенизация)
+    3. Fuzzy matching с порогом 85 - для всех оставшихся описаний одним
+       вызовом best_fuzzy_keys (кэш + process.cdist)
+
+    Args:
+        descriptions: названия компонентов из PDF
+        keys: KeyIndex компонентов BOM или колонок Manager
+
+    Returns:
+        {description: (key, value, match_type) или (None, None, None)}
+    """
+
+    matches = {}
+    fuzzy_descriptions = []
+
+    for description in dict.fromkeys(descriptions):
+        index, match_type = match_key_words(description.lower().strip(), keys)
+
+        if index is not None:
+            matches[description] = (keys.names[index], keys.values[index], match_type)
+        else:
+            matches[description] = (None, None, None)
+            fuzzy_descriptions.append(description)
 
-    # ===== ПРИОРИТЕТ 3: FUZZY MATCHING (только если ничего не нашли) =====
-    best_match = None
-    best_score = 0
+    if not fuzzy_descriptions or not keys.names:
+        return matches
 
-    for bom_name, bom_data in bom_components.items():
-        bom_lower = bom_name.lower().strip()
+    fuzzy_matches = best_fuzzy_keys(
+        [utils.default_process(d.lower().strip()) for d in fuzzy_descriptions],
+        keys.processed,
+    )
 
-        score = fuzz.token_sort_ratio(pdf_lower, bom_lower)
+    for description, (index, score) in zip(fuzzy_descriptions, fuzzy_matches):
+        if index is not None:
+            matches[description] = (
+                keys.names[index],
+                keys.values[index],
+                f"fuzzy_{score}",
+            )
 
-        # ВАЖНО: Высокий порог 85 (было 70)
-        # Избегаем ложных срабатываний типа "Operator Flange" → "Operator Nut"
-        if score > best_score and score >= 85:
-            best_score = score
-            best_match = (bom_name, bom_data)
+    return matches
 
-    if best_match:
-        return (best_match[0], best_match[1], f"fuzzy_{best_score}")
 
-    # Ничего не нашли
-    return (None, None, None)
+def find_best_component_match(pdf_description, bom_components, bom_keys=None):
+    """
+    Находит лучшее совпадение компонента из BOM для PDF компонента
+
+    Приоритеты те же, что в match_descriptions (для одного описания)
+
+    Args:
+        pdf_description: название компонента из PDF
+        bom_components: dict с компонентами BOM {name: {material, quantity}}
+        bom_keys: результат prepare_keys(bom_components) (опционально)
+
+    Returns:
+        (bom_name, bom_data, match_type) или (None, None, None)
+    """
+
+    if bom_keys is None:
+        bom_keys = prepare_keys(bom_components)
+
+    return match_descriptions([pdf_description], bom_keys)[pdf_description]
+
+
+def find_matching_manager_column(pdf_description, manager_materials, manager_keys=None):
+    """
+    Находит соответствующую колонку Manager для компонента PDF
+
+    Приоритеты те же, что в match_descriptions (для одного описания)
+
+    Args:
+        pdf_description: "Body", "Ball", "Seat Spring", etc.
+        manager_materials: {"Body": "A350 LF2", "Ball": "A182 F316", ...}
+        manager_keys: результат prepare_keys(manager_materials) (опционально)
+
+    Returns:
+        ("Body", "A350 LF2") или (None, None)
+    """
+
+    if manager_keys is None:
+        manager_keys = prepare_keys(manager_materials)
+
+    matches = match_descriptions([pdf_description], manager_keys)
+    name, value, _ = matches[pdf_description]
+
+    return (name, value)
 
 
 def parse_bom_sheet(filepath, sheet_index):
@@ -99,13 +400,32 @@ def parse_bom_sheet(filepath, sheet_index):
         }
     """
 
-    wb = openpyxl.load_workbook(filepath, data_only=True)
-    ws = wb.worksheets[sheet_index]
+    # Строки 28-100: строка 28 - поля для валидации, 31+ - компоненты
+    rows = read_sheet_rows(filepath, sheet_index, min_row=28, max_row=100, max_col=43)
 
     # Извлекаем поля для валидации из строки 28
-    size = ws.cell(28, 4).value  # D28 - Dimensione
-    asme = ws.cell(28, 15).value  # O28 - Classe
-    ends = ws.cell(28, 25).value  # Y28 - Estremità
+    row28 = rows[0] if rows else (None,) * 43
+    size = row28[3]  # D28 - Dimensione
+    asme = row28[14]  # O28 - Classe
+    ends = row28[24]  # Y28 - Estremità
+
+    components = parse_bom_components(rows[3:])
+
+    return {
+        "size": str(size).strip() if size else None,
+        "asme": str(asme).strip() if asme else None,
+        "ends": str(ends).strip() if ends else None,
+        "components": components,
+    }
+
+
+def parse_bom_components(rows):
+    """
+    Парсит компоненты BOM из значений строк 31-100
+
+    Returns:
+        {"Body": {"quantity": 1, "material": "ASTM A350 LF2 CL.1"}, ...}
+    """
 
     components = {}
 
@@ -114,18 +434,17 @@ def parse_bom_sheet(filepath, sheet_index):
     last_component_data = None
 
     # Парсим компоненты (строки 31+)
-    for row in ws.iter_rows(min_row=31, max_row=100, values_only=True):
-        if len(row) <= 42:
-            continue
-
+    for row in rows:
         component_name = row[28]  # AC (index 28) - Descrizione componente
         quantity = row[42]  # AQ (index 42) - Q.tà
         material = row[5]  # F (index 5) - MAT.
 
-        # СЛУЧАЙ 1: Строка с компонентом
-        if component_name and str(component_name).strip() != "":
-            name = str(component_name).strip()
+        # str().strip() один раз на ячейку
+        name = str(component_name).strip() if component_name else ""
+        mat = str(material).strip() if material else ""
 
+        # СЛУЧАЙ 1: Строка с компонентом
+        if name:
             # Пропускаем заголовок
             if name == "Descrizione componente":
                 continue
@@ -138,30 +457,45 @@ def parse_bom_sheet(filepath, sheet_index):
             except (ValueError, TypeError):
                 qty = 1
 
-            # Извлекаем материал из колонки F (MAT.)
-            mat = str(material).strip() if material else ""
-
+            # Материал из колонки F (MAT.)
             last_component_data = {"quantity": qty, "material": mat}
 
             # Сохраняем компонент
             components[name] = last_component_data
 
         # СЛУЧАЙ 2: Пустая строка (component_name пустое, но есть материал)
-        elif material and str(material).strip() != "" and last_component_name:
+        elif mat and last_component_name:
             # Эта строка относится к предыдущему компоненту!
-            full_material = str(material).strip()
+            full_material = mat
 
             # Обновляем материал предыдущего компонента ПОЛНЫМ названием
             if last_component_name in components:
                 components[last_component_name]["material"] = full_material
-                print(f"  ✅ Обновлен материал для '{last_component_name}': '{full_material}'")
+                logger.debug(
+                    "Обновлен материал для '%s': '%s'",
+                    last_component_name,
+                    full_material,
+                )
+
+    return components
 
-    return {
-        "size": str(size).strip() if size else None,
-        "asme": str(asme).strip() if asme else None,
-        "ends": str(ends).strip() if ends else None,
-        "components": components,
-    }
+
+# Удаляет кавычки (дюймы: 12" / 12'') за один проход по строке
+QUOTE_STRIP = str.maketrans("", "", "\"'")
+
+
+def clean_size(value):
+    """
+    Нормализует размер для сравнения: без кавычек и пробелов по краям
+
+    Args:
+        value: размер ("12\"", "12''", ...) или None
+
+    Returns:
+        "12" (или "" для пустого значения)
+    """
+
+    return value.translate(QUOTE_STRIP).strip() if value else ""
 
 
 def validate_bom_with_pdf(bom_data, pdf_size, pdf_asme, pdf_ends):
@@ -178,14 +512,8 @@ def validate_bom_with_pdf(bom_data, pdf_size, pdf_asme, pdf_ends):
     errors = []
 
     # Нормализуем для сравнения
-    bom_size = (
-        bom_data["size"].replace('"', "").replace("'", "").strip()
-        if bom_data["size"]
-        else ""
-    )
-    pdf_size_clean = (
-        pdf_size.replace('"', "").replace("'", "").strip() if pdf_size else ""
-    )
+    bom_size = clean_size(bom_data["size"])
+    pdf_size_clean = clean_size(pdf_size)
 
     bom_asme = bom_data["asme"].strip() if bom_data["asme"] else ""
     pdf_asme_clean = pdf_asme.strip() if pdf_asme else ""
@@ -224,47 +552,68 @@ def parse_manager_sheet(filepath, target_size, target_asme):
         }
     """
 
-    wb = openpyxl.load_workbook(filepath, data_only=True)
-    ws = wb.active  # Первый лист
-
-    # Маппинг колонок на компоненты (Col 18-30)
-    component_columns = {
-        18: "Body",
-        19: "Closures",
-        20: "Gland",
-        21: "Trunnion",
-        22: "Weld overlay",
-        23: "Ball",
-        24: "Seat rings",
-        25: "Seat inserts",
-        26: "Stem",
-        27: "Dynamic seals",
-        28: "Static seals",
-        29: "Fire Safe gaskets",
-        30: "Springs",
-    }
+    # Первый лист, строки 15-99; нужны только колонки 9-30 (Size, Class, материалы)
+    rows = read_sheet_rows(filepath, 0, min_row=15, max_row=99, min_col=9, max_col=30)
+
+    return find_manager_row(rows, target_size, target_asme)
+
+
+# Столько пустых строк (нет ни Size, ни Class) подряд - конец таблицы Manager
+MANAGER_MAX_EMPTY_ROWS = 3
+
+# Компоненты в колонках 18-30 листа Manager (по порядку)
+MANAGER_COMPONENTS = (
+    "Body",
+    "Closures",
+    "Gland",
+    "Trunnion",
+    "Weld overlay",
+    "Ball",
+    "Seat rings",
+    "Seat inserts",
+    "Stem",
+    "Dynamic seals",
+    "Static seals",
+    "Fire Safe gaskets",
+    "Springs",
+)
+
+
+def find_manager_row(rows, target_size, target_asme):
+    """
+    Ищет среди строк order-manager (начиная с 15-й) строку с нужными Size и Class
+
+    Строки содержат только колонки 9-30: row[0] - колонка 9
+
+    Returns:
+        см. parse_manager_sheet
+    """
 
     # Нормализуем target для сравнения
-    target_size_clean = (
-        target_size.replace('"', "").replace("'", "").strip() if target_size else ""
-    )
+    target_size_clean = clean_size(target_size)
     target_asme_clean = target_asme.strip() if target_asme else ""
 
     # Ищем строку с нужными Size и Class
-    for row_idx in range(15, 100):
-        row = list(ws.iter_rows(min_row=row_idx, max_row=row_idx, values_only=True))[0]
+    empty_streak = 0
 
-        if len(row) < 30:
+    for row_idx, row in enumerate(rows, start=15):
+        size_value = row[0]  # Col 9 - Size (Inch)
+        class_value = row[1]  # Col 10 - Class (lbs)
+
+        # Данные закончились - не сканируем остаток до строки 99
+        if not size_value and not class_value:
+            empty_streak += 1
+            if empty_streak >= MANAGER_MAX_EMPTY_ROWS:
+                break
             continue
 
-        size_value = row[8]  # Col 9 - Size (Inch)
-        class_value = row[9]  # Col 10 - Class (lbs)
+        empty_streak = 0
 
         if not size_value or not class_value:
             continue
 
         # Нормализуем значения
-        size_str = str(size_value).replace('"', "").replace("'", "").strip()
+        size_str = clean_size(str(size_value))
         class_str = str(class_value).strip()
 
         # Проверяем совпадение
@@ -272,11 +621,12 @@ def parse_manager_sheet(filepath, target_size, target_asme):
             # Нашли нужную строку! Извлекаем материалы
             materials = {}
 
-            for col_idx, component_name in component_columns.items():
-                material = row[col_idx - 1]  # -1 потому что row с индекса 0
+            # Колонки 18-30 (row начинается с колонки 9)
+            for component_name, material in zip(MANAGER_COMPONENTS, row[9:22]):
+                material_str = str(material).strip() if material else ""
 
-                if material and str(material).strip():
-                    materials[component_name] = str(material).strip()
+                if material_str:
+                    materials[component_name] = material_str
 
             return {
                 "found": True,
@@ -292,61 +642,6 @@ def parse_manager_sheet(filepath, target_size, target_asme):
     }
 
 
-def find_matching_manager_column(pdf_description, manager_materials):
-    """
-    Находит соответствующую колонку Manager для компонента PDF
-
-    ПРАВИЛЬНАЯ ЛОГИКА С ПРИОРИТЕТАМИ (как в find_best_component_match):
-    1. Точное совпадение
-    2. Все слова из PDF есть в Manager
-    3. Fuzzy matching с высоким порогом
-
-    Args:
-        pdf_description: "Body", "Ball", "Seat Spring", etc.
-        manager_materials: {"Body": "A350 LF2", "Ball": "A182 F316", ...}
-
-    Returns:
-        ("Body", "A350 LF2") или (None, None)
-    """
-
-    pdf_lower = pdf_description.lower().strip()
-
-    # 1. Точное совпадение (case-insensitive)
-    for manager_key, manager_value in manager_materials.items():
-        if pdf_lower == manager_key.lower():
-            return (manager_key, manager_value)
-
-    # 2. Все слова из PDF есть в Manager
-    pdf_words = set(pdf_lower.replace("/", " ").replace("-", " ").split())
-
-    word_matches = []
-    for manager_key, manager_value in manager_materials.items():
-        manager_lower = manager_key.lower().strip()
-        manager_words = set(manager_lower.replace("/", " ").replace("-", " ").split())
-
-        if pdf_words.issubset(manager_words):
-            extra_words = len(manager_words - pdf_words)
-            word_matches.append((manager_key, manager_value, extra_words))
-
-    if word_matches:
-        word_matches.sort(key=lambda x: x[2])
-        return (word_matches[0][0], word_matches[0][1])
-
-    # 3. Fuzzy match (только если ничего не нашли)
-    best_match = None
-    best_score = 0
-
-    for manager_key, manager_value in manager_materials.items():
-        score = fuzz.token_sort_ratio(pdf_lower, manager_key.lower())
-
-        if score > best_score and score >= 85:  # Повышен порог: 80 → 85
-            best_score = score
-            best_match = (manager_key, manager_value)
-
-    return best_match if best_match else (None, None)
-
-
-
 def merge_all_data(pdf_data, bom_components, manager_materials):
     """
     Объединяет данные из PDF, BOM и Manager с УМНЫМ сравнением материалов
@@ -372,58 +667,79 @@ def merge_all_data(pdf_data, bom_components, manager_materials):
     # Отслеживаем какие колонки Manager мы уже использовали
     used_manager_columns = set()
 
+    # Один и тот же список для обхода и для добавления "new" компонентов
+    # (setdefault - иначе при отсутствии table2 добавленные строки теряются)
+    table2 = pdf_data.setdefault("table2", [])
+
+    # Ключи BOM/Manager не меняются - приводим их к нижнему регистру один раз
+    bom_keys = prepare_keys(bom_components)
+    manager_keys = prepare_keys(manager_materials)
+
+    # Сопоставляем сразу все описания: один fuzzy проход (матрица cdist)
+    # для BOM и один для Manager вместо поиска на каждую строку PDF
+    descriptions = [
+        description
+        for description in ((item.get("description") or "").strip() for item in table2)
+        if description
+    ]
+    bom_matches = match_descriptions(descriptions, bom_keys)
+    manager_matches = match_descriptions(descriptions, manager_keys)
+
     # Обрабатываем компоненты из PDF
-    for item in pdf_data.get("table2", []):
-        description = item.get("description", "").strip()
-        pdf_material = item.get("material", "").strip()
+    for item in table2:
+        # Claude может вернуть null вместо пустой строки
+        description = (item.get("description") or "").strip()
+        pdf_material = (item.get("material") or "").strip()
 
         if not description:
             continue
 
         # ===== ШАГ 1: Ищем в BOM (ПРАВИЛЬНАЯ ЛОГИКА С ПРИОРИТЕТАМИ!) =====
-        bom_name, bom_data, match_type = find_best_component_match(description, bom_components)
+        bom_name, bom_data, match_type = bom_matches[description]
 
         if bom_data:
             matched_bom = bom_data
             bom_material = bom_data.get("material", "")
-            print(f"  🔗 '{description}' → '{bom_name}' ({match_type})")
+            logger.debug("'%s' → '%s' (%s)", description, bom_name, match_type)
         else:
             matched_bom = None
             bom_material = ""
 
-
         # Достаем quantity из BOM
         bom_quantity = matched_bom["quantity"] if matched_bom else None
 
-        # ===== ШАГ 2: Умное сравнение материала PDF с BOM =====
-        bom_materials_match = False
-        if pdf_material and bom_material:
-            bom_materials_match, _ = smart_material_match(pdf_material, bom_material)
-
-        # ===== ШАГ 3: Находим соответствующую колонку в Manager =====
-        manager_column, manager_material = find_matching_manager_column(
-            description, manager_materials
-        )
+        # ===== ШАГ 2: Находим соответствующую колонку в Manager =====
+        manager_column, manager_material, _ = manager_matches[description]
 
         if manager_column:
             used_manager_columns.add(manager_column)
 
-        # ===== ШАГ 4: Умное сравнение материала PDF с Order =====
+        # ===== ШАГ 3: Умное сравнение материала PDF с BOM и Order =====
+        # Без материала в PDF сравнивать нечего; если совпал BOM, статус уже
+        # "equal" и сравнение с Order не нужно
+        bom_materials_match = False
         order_materials_match = False
-        if pdf_material and manager_material:
-            order_materials_match, _ = smart_material_match(pdf_material, manager_material)
 
-        # ===== ШАГ 5: Определяем статус =====
+        if pdf_material:
+            if bom_material:
+                bom_materials_match, _ = smart_material_match(
+                    pdf_material, bom_material
+                )
+
+            if manager_material and not bom_materials_match:
+                order_materials_match, _ = smart_material_match(
+                    pdf_material, manager_material
+                )
+
+        # ===== ШАГ 4: Определяем статус =====
         if bom_materials_match or order_materials_match:
             status = "equal"
-        elif (bom_material or manager_material) and not (
-            bom_materials_match or order_materials_match
-        ):
+        elif bom_material or manager_material:
             status = "notEqual"
         else:
             status = "equal"
 
-        # ===== ШАГ 6: Формируем результат =====
+        # ===== ШАГ 5: Формируем результат =====
         item["material"] = pdf_material
         item["bom_material"] = bom_material if bom_material else None
         item["order_material"] = manager_material if manager_material else None
@@ -434,7 +750,7 @@ def merge_all_data(pdf_data, bom_components, manager_materials):
         if "note" not in item:
             item["note"] = ""
 
-    # ===== ШАГ 7: Добавляем компоненты которых НЕТ в PDF, но ЕСТЬ в Manager =====
+    # ===== ШАГ 6: Добавляем компоненты которых НЕТ в PDF, но ЕСТЬ в Manager =====
     for manager_column, manager_material in manager_materials.items():
         if manager_column not in used_manager_columns:
             new_item = {
@@ -449,6 +765,6 @@ def merge_all_data(pdf_data, bom_components, manager_materials):
                 "note": "",
             }
 
-            pdf_data.get("table2", []).append(new_item)
+            table2.append(new_item)
 
     return pdf_data
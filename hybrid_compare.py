@@ -11,6 +11,7 @@
 """
 
 import re
+from functools import lru_cache
 from typing import Tuple
 
 # ============================================================================
@@ -63,7 +64,23 @@ MATERIAL_SYNONYMS = {
 # НОРМАЛИЗАЦИЯ
 # ============================================================================
 
+# Регулярные выражения компилируются один раз при импорте
+WHITESPACE_RE = re.compile(r"\s+")
 
+# Значимые токены одним проходом: буквенно-цифровой блок [A-Z0-9]+
+# длиной >= 3 или из 2 символов с цифрой (A1, 7M, 12)
+TOKEN_RE = re.compile(
+    r"(?<![A-Z0-9])(?:[A-Z0-9]{3,}|[0-9][A-Z0-9]|[A-Z][0-9])(?![A-Z0-9])"
+)
+
+# Слэши и дефисы → пробелы (один проход по строке)
+SEPARATORS_TABLE = str.maketrans({"/": " ", "-": " "})
+
+# Буквы и цифры, по которым работает быстрый префильтр
+ALNUM_CHARS = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789")
+
+
+@lru_cache(maxsize=4096)
 def normalize(text: str) -> str:
     """
     Нормализует материал для сравнения
@@ -74,6 +91,9 @@ def normalize(text: str) -> str:
     - Префиксы (ASTM, ASME)
     - Приводит к uppercase
 
+    Результат кэшируется: одни и те же материалы BOM/Order сравниваются
+    с каждой строкой PDF
+
     Args:
         text: Исходный текст
 
@@ -86,7 +106,7 @@ def normalize(text: str) -> str:
     text = str(text).upper().strip()
 
     # Заменяем слэши и дефисы на пробелы
-    text = text.replace("/", " ").replace("-", " ")
+    text = text.translate(SEPARATORS_TABLE)
 
     # Убираем точки после сокращений
     text = text.replace("GR.", "GR").replace("CL.", "CL")
@@ -95,16 +115,49 @@ def normalize(text: str) -> str:
     text = text.replace("ASTM ", "").replace("ASME ", "")
 
     # Убираем лишние пробелы
-    text = re.sub(r"\s+", " ", text).strip()
+    text = WHITESPACE_RE.sub(" ", text).strip()
 
     return text
 
 
+@lru_cache(maxsize=4096)
+def material_charset(text: str) -> frozenset:
+    """
+    Набор латинских букв и цифр материала (для быстрого префильтра)
+
+    Args:
+        text: Исходный текст
+
+    Returns:
+        frozenset символов A-Z / 0-9
+    """
+    return ALNUM_CHARS.intersection(str(text).upper())
+
+
 # ============================================================================
 # ПРОВЕРКА ПО СЛОВАРЮ
 # ============================================================================
 
 
+def build_synonym_index() -> dict:
+    """
+    Строит обратный индекс словаря синонимов (один раз при импорте)
+
+    Returns:
+        {нормализованный синоним: frozenset групп, в которые он входит}
+    """
+    index = {}
+
+    for base_name, synonyms in MATERIAL_SYNONYMS.items():
+        for synonym in synonyms:
+            index.setdefault(normalize(synonym), set()).add(base_name)
+
+    return {synonym: frozenset(groups) for synonym, groups in index.items()}
+
+
+SYNONYM_INDEX = build_synonym_index()
+
+
 def check_synonyms(mat1: str, mat2: str) -> bool:
     """
     Проверяет материалы по словарю синонимов
@@ -116,19 +169,28 @@ def check_synonyms(mat1: str, mat2: str) -> bool:
     Returns:
         True если оба материала в одной группе синонимов
     """
-    norm1 = normalize(mat1)
-    norm2 = normalize(mat2)
+    return same_synonym_group(normalize(mat1), normalize(mat2))
 
-    # Проверяем каждую группу синонимов
-    for base_name, synonyms in MATERIAL_SYNONYMS.items():
-        # Нормализуем все синонимы
-        normalized_synonyms = [normalize(s) for s in synonyms]
 
-        # Если оба материала в этой группе → совпадают
-        if norm1 in normalized_synonyms and norm2 in normalized_synonyms:
-            return True
+def same_synonym_group(norm1: str, norm2: str) -> bool:
+    """
+    Проверка по словарю синонимов для уже нормализованных материалов
+
+    Args:
+        norm1: normalize(первый материал)
+        norm2: normalize(второй материал)
+
+    Returns:
+        True если оба материала в одной группе синонимов
+    """
+    groups1 = SYNONYM_INDEX.get(norm1)
+    groups2 = SYNONYM_INDEX.get(norm2)
+
+    # Если оба материала в одной группе → совпадают
+    if groups1 is None or groups2 is None:
+        return False
 
-    return False
+    return not groups1.isdisjoint(groups2)
 
 
 # ============================================================================
@@ -136,7 +198,7 @@ def check_synonyms(mat1: str, mat2: str) -> bool:
 # ============================================================================
 
 
-def extract_tokens(text: str) -> set:
+def extract_tokens(text: str) -> frozenset:
     """
     Извлекает значимые токены из материала
 
@@ -148,29 +210,30 @@ def extract_tokens(text: str) -> set:
         text: Исходный текст
 
     Returns:
-        Множество токенов
+        Множество токенов (frozenset - результат кэшируется)
     """
     if not text:
-        return set()
+        return frozenset()
 
-    # Нормализация
-    text = normalize(text)
+    return tokens_from_normalized(normalize(text))
 
-    # Извлекаем буквенно-цифровые токены
-    tokens = re.findall(r"[A-Z0-9]+", text)
 
-    # Фильтруем значимые
-    result = set()
-    for token in tokens:
-        has_digit = any(c.isdigit() for c in token)
+@lru_cache(maxsize=4096)
+def tokens_from_normalized(text: str) -> frozenset:
+    """
+    Извлекает значимые токены из уже нормализованного материала
 
-        # Токен значимый если:
-        # 1. Содержит цифру И длина >= 2
-        # 2. Длина >= 3
-        if (has_digit and len(token) >= 2) or len(token) >= 3:
-            result.add(token)
+    Args:
+        text: normalize(материал)
 
-    return result
+    Returns:
+        Множество токенов (см. extract_tokens)
+    """
+    # Токен значимый если:
+    # 1. Содержит цифру И длина >= 2
+    # 2. Длина >= 3
+    # Фильтр встроен в регулярное выражение - отдельного цикла нет
+    return frozenset(TOKEN_RE.findall(text))
 
 
 def check_tokens(mat1: str, mat2: str) -> bool:
@@ -232,7 +295,18 @@ def smart_material_match(material1: str, material2: str) -> Tuple[bool, str]:
     if not material1 or not material2:
         return (False, "empty")
 
-    # 2. Нормализация
+    # Одинаковые строки - нормализация не нужна
+    if material1 == material2:
+        return (True, "exact")
+
+    # Префильтр: нет ни одной общей буквы/цифры → ни синонимы, ни токены
+    # совпасть не могут (пустые наборы пропускаем - решит нормализация)
+    charset1 = material_charset(material1)
+    charset2 = material_charset(material2)
+    if charset1 and charset2 and charset1.isdisjoint(charset2):
+        return (False, "none")
+
+    # 2. Нормализация (один раз - дальше все проверки работают с norm1/norm2)
     norm1 = normalize(material1)
     norm2 = normalize(material2)
 
@@ -241,11 +315,11 @@ def smart_material_match(material1: str, material2: str) -> Tuple[bool, str]:
         return (True, "exact")
 
     # 4. Проверка по словарю синонимов
-    if check_synonyms(material1, material2):
+    if same_synonym_group(norm1, norm2):
         return (True, "synonym")
 
     # 5. Проверка токенов
-    if check_tokens(material1, material2):
+    if not tokens_from_normalized(norm1).isdisjoint(tokens_from_normalized(norm2)):
         return (True, "token")
 
     # 6. Не совпало
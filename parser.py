@@ -1,48 +1,62 @@
+import asyncio
 import base64
-import json
+import contextvars
+import hashlib
+import math
 import os
+import random
 import re
+from functools import lru_cache
 from io import BytesIO
+from typing import NotRequired, Optional, TypedDict, Union
 
 import anthropic
-from pdf2image import convert_from_path
+import msgspec
+import orjson
+import pymupdf
+from PIL import Image
 
+from disk_cache import read_cache_entry, write_cache_entry
 
-def parse_technical_params(pdf_path, api_key):
-    """
-    Парсит ТОЛЬКО технические параметры из bottom-left зоны чертежа
+# Модель Claude для распознавания чертежей
+CLAUDE_MODEL = "claude-sonnet-4-20250514"
 
-    Returns:
-        dict: {
-            "DESIGN_TEMP": "...",
-            "DESIGN_PRESSURE": "...",
-            "PRESSURE_TEST_BODY": "...",
-            "PRESSURE_TEST_SEAT": "..."
-        }
-    """
+# Количество повторов запроса к Claude API (429 / 5xx / overloaded /
+# сетевые ошибки) и экспоненциальная задержка между ними (секунды)
+API_MAX_RETRIES = 4
+API_RETRY_BASE_DELAY = 1.0
+API_RETRY_MAX_DELAY = 30.0
 
-    print("🔄 Извлекаю технические параметры из bottom-left зоны...")
+# Типы ошибок, которые Claude присылает посреди потока ответа (HTTP статус
+# при этом уже 200) и которые имеет смысл повторить
+RETRYABLE_STREAM_ERRORS = {"overloaded_error", "api_error", "rate_limit_error"}
 
-    # Конвертируем PDF в изображение
-    images = convert_from_path(pdf_path, dpi=600)  # Высокое разрешение для OCR
-    full_image = images[0]
+# DPI рендера страницы чертежа. Страница рендерится один раз и общая для
+# parse_drawing_pdf_ai и parse_technical_params; оба изображения уменьшаются
+# до VISION_MAX_PIXELS, 300 DPI с запасом хватает и для зоны параметров
+PAGE_DPI = 300
 
-    # Вырезаем bottom-left зону (где находятся технические параметры)
-    width, height = full_image.size
-    left = 0
-    top = int(height * 0.65)  # Нижние 35%
-    right = int(width * 0.35)  # Левые 35%
-    bottom = height
+# Бюджет пикселей изображения для Claude (~1.3 MP): больше API все равно
+# уменьшает на своей стороне, а лишние пиксели - это время и токены
+VISION_MAX_PIXELS = 1_300_000
 
-    bottom_left = full_image.crop((left, top, right, bottom))
+# Длинная сторона изображения: Claude уменьшает все, что больше 1568 px
+VISION_MAX_SIDE = 1568
 
-    # Конвертируем в base64
-    buffered = BytesIO()
-    bottom_left.save(buffered, format="PNG")
-    img_base64 = base64.b64encode(buffered.getvalue()).decode()
+# Зона технических параметров - несколько строк крупного текста, ей хватает
+# меньшего изображения (меньше vision-токенов; аналог detail="low", которого
+# в Anthropic API нет)
+TECH_PARAMS_MAX_SIDE = 1024
+
+# Качество JPEG для фрагментов чертежа (PNG кодируется дольше и весит в
+# несколько раз больше)
+JPEG_QUALITY = 88
+
+# Markdown-обертка ответа Claude (```json ... ```) - убирается одним проходом
+FENCE_RE = re.compile(r"```(?:json)?\s*")
 
-    # Фокусированный промпт ТОЛЬКО для технических параметров
-    prompt = """Extract ONLY the technical parameters from this section of an engineering drawing.
+# Фокусированный промпт ТОЛЬКО для технических параметров
+TECH_PARAMS_PROMPT = """Extract ONLY the technical parameters from this section of an engineering drawing.
 
 Look for these specific fields in the text block labeled "TECHNICAL REMARKS AND CONSTRUCTION DETAIL":
 
@@ -66,72 +80,24 @@ IMPORTANT:
 - Return ONLY the JSON object, no markdown, no explanations
 """
 
-    # Отправляем в Claude API
-    client = anthropic.Anthropic(api_key=api_key)
-
-    response = client.messages.create(
-        model="claude-sonnet-4-20250514",
-        max_tokens=1000,
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "image",
-                        "source": {
-                            "type": "base64",
-                            "media_type": "image/png",
-                            "data": img_base64,
-                        },
-                    },
-                    {"type": "text", "text": prompt},
-                ],
-            }
-        ],
-    )
-
-    response_text = response.content[0].text
-
-    # Очищаем от markdown
-    response_text = re.sub(r"```json\s*", "", response_text)
-    response_text = re.sub(r"```\s*", "", response_text)
-    response_text = response_text.strip()
-
-    result = json.loads(response_text)
-
-    print("✅ Технические параметры извлечены!")
-    return result
-
-
-def parse_drawing_pdf_ai(pdf_path, api_key):
-    """
-    Парсит PDF чертеж через Claude API
-
-    Args:
-        pdf_path: путь к PDF файлу
-        api_key: Claude API ключ
-
-    Returns:
-        dict: {table1: [...], table2: [...], table3: [...]}
-    """
-
-    print("🔄 Конвертирую PDF в изображение (DPI 500)...")
-    images = convert_from_path(pdf_path, dpi=500)
-    page1_image = images[0]
-
-    print("🔄 Конвертирую изображение в base64...")
-    buffered = BytesIO()
-    page1_image.save(buffered, format="PNG")
-    img_base64 = base64.b64encode(buffered.getvalue()).decode()
-
-    # ФИНАЛЬНЫЙ ПРОМПТ с детальными OCR правилами
-    prompt = """Extract data from this engineering drawing and return ONLY a valid JSON object.
+# Промпты по таблицам чертежа: каждая таблица распознается по своему
+# фрагменту изображения (см. DRAWING_REGIONS)
+DRAWING_PROMPT_HEADER = """Extract data from this section of an engineering drawing and return ONLY a valid JSON object.
 
 CRITICAL: Your ENTIRE response must be ONLY valid JSON. No explanations, no markdown, no text before or after.
 
-Extract these three tables:
+"""
 
-**Table 1** (top-right dimensions table):
+DRAWING_PROMPT_FOOTER = """
+IMPORTANT REMINDERS:
+- Keep exact values including special characters
+- Preserve all text exactly as shown
+- If a field is not found, use empty string ""
+- DO NOT add any text outside the JSON object
+"""
+
+TABLE1_PROMPT = (
+    DRAWING_PROMPT_HEADER + """Extract **Table 1** (top-right dimensions table):
 - Headers: SIZE(inch), ASME, ENDS, L, Ød, ØF, H, WEIGHT
 - Extract the VALUES from the row below the headers
 - CRITICAL - READ EACH VALUE CAREFULLY:
@@ -143,18 +109,6 @@ Extract these three tables:
   * If you see L=295, H=350, WEIGHT=45 → use EXACTLY these values
   * Some values may have "~" suffix - preserve it!
 
-**Table 2** (right-side Bill of Materials):
-- THIS IS CRITICAL: Read the COMPLETE table from top to bottom!
-- Headers: Pos, Description, Material, Note
-- Extract EVERY SINGLE ROW - there are typically 35-45 rows
-- DO NOT stop early - read until the very last component
-- Some position numbers have "*" prefix (e.g., *256, *364) - preserve this!
-- Position numbers range from 1 to 700+
-- If "Note" column is empty, use empty string ""
-
-**Table 3** (bottom-right information block):
-- Extract: CUSTOMER, PROJECT/LOCATION, EPC/END USER, P.O. No, TAG No, ECV JOB No, ITEM, VALVE D.S., DOC No
-
 Return JSON in this EXACT structure:
 
 {
@@ -167,23 +121,33 @@ Return JSON in this EXACT structure:
     {"field": "ØF", "value": "559"},
     {"field": "H", "value": "385~"},
     {"field": "WEIGHT", "value": "1200~"}
-  ],
+  ]
+}
+
+SPECIAL CHARACTERS:
+- Tilde (~): "385~", "1200~"
+- Diameter (Ø): Use Ø character
+""" + DRAWING_PROMPT_FOOTER
+)
+
+TABLE2_PROMPT = (
+    DRAWING_PROMPT_HEADER + """Extract **Table 2** (right-side Bill of Materials):
+- THIS IS CRITICAL: Read the COMPLETE table from top to bottom!
+- Headers: Pos, Description, Material, Note
+- Extract EVERY SINGLE ROW - there are typically 35-45 rows
+- DO NOT stop early - read until the very last component
+- Some position numbers have "*" prefix (e.g., *256, *364) - preserve this!
+- Position numbers range from 1 to 700+
+- If "Note" column is empty, use empty string ""
+
+Return JSON in this EXACT structure:
+
+{
   "table2": [
     {"pos": "1", "description": "Body", "material": "ASTM A350 LF2 CL1", "note": ""},
     {"pos": "2", "description": "Body End", "material": "...", "note": "..."},
     ... (CONTINUE extracting ALL rows - don't stop!)
     {"pos": "704", "description": "Ring Joint Ring", "material": "...", "note": ""}
-  ],
-  "table3": [
-    {"CUSTOMER": "value"},
-    {"PROJECT/LOCATION": "value"},
-    {"EPC/END USER": "value"},
-    {"P.O. No": "value"},
-    {"TAG No": "value"},
-    {"ECV JOB No": "value"},
-    {"ITEM": "value"},
-    {"VALVE D.S.": "value"},
-    {"DOC No": "value"}
   ]
 }
 
@@ -230,9 +194,6 @@ CRITICAL OCR ACCURACY RULES - READ CAREFULLY:
    - If empty, use ""
 
 6. **SPECIAL CHARACTERS:**
-   - Tilde (~): "385~", "1200~"
-   - Degree (°): Use proper degree symbol
-   - Diameter (Ø): Use Ø character
    - Asterisk (*): Preserve in position numbers
    - Plus (+): "SS Gr.316 + PTFE", "+HDG"
 
@@ -248,21 +209,281 @@ DOUBLE-CHECK THESE SPECIFIC ROWS (common errors):
 - pos 578: "Gear", material "CAST IRON" - don't skip this!
 - pos 704: "Ring Joint Ring", material "SOFT IRON" (NOT "API 6A")
 
-IMPORTANT REMINDERS:
 - READ THE COMPLETE TABLE - there are 40+ rows!
-- Keep exact values including special characters
-- Preserve all text exactly as shown
-- If a field is not found, use empty string ""
-- DO NOT add any text outside the JSON object
 - When uncertain between similar words, consider context (valve parts)
-"""
+""" + DRAWING_PROMPT_FOOTER
+)
+
+TABLE3_PROMPT = (
+    DRAWING_PROMPT_HEADER + """Extract **Table 3** (bottom-right information block):
+- Extract: CUSTOMER, PROJECT/LOCATION, EPC/END USER, P.O. No, TAG No, ECV JOB No, ITEM, VALVE D.S., DOC No
+
+Return JSON in this EXACT structure:
+
+{
+  "table3": [
+    {"CUSTOMER": "value"},
+    {"PROJECT/LOCATION": "value"},
+    {"EPC/END USER": "value"},
+    {"P.O. No": "value"},
+    {"TAG No": "value"},
+    {"ECV JOB No": "value"},
+    {"ITEM": "value"},
+    {"VALVE D.S.": "value"},
+    {"DOC No": "value"}
+  ]
+}
+""" + DRAWING_PROMPT_FOOTER
+)
+
+# Схемы ответов Claude. msgspec проверяет структуру прямо при разборе JSON:
+# ответ без нужных ключей падает сразу, а не KeyError где-то в merge.
+# Значения - только строки: дальше они идут в .strip() / clean_size().
+# Числа ("value": 600) Claude иногда возвращает - они приводятся к str
+# прямо при разборе (см. Text и text_dec_hook)
+
+
+class Text(str):
+    """Строковое значение ответа Claude: число из JSON приводится к str"""
+
+
+def text_dec_hook(type_, obj):
+    """dec_hook для msgspec: строка или число из JSON -> Text"""
+
+    if type_ is Text:
+        if isinstance(obj, (str, int, float)) and not isinstance(obj, bool):
+            return Text(obj)
+
+        raise ValueError(f"Expected str or number, got {type(obj).__name__}")
+
+    raise NotImplementedError(f"Unsupported type: {type_}")
+
+
+Scalar = Optional[Text]
+
+
+class TechnicalParams(TypedDict, total=False):
+    DESIGN_TEMP: Scalar
+    DESIGN_PRESSURE: Scalar
+    PRESSURE_TEST_BODY: Scalar
+    PRESSURE_TEST_SEAT: Scalar
+
+
+class DimensionRow(TypedDict):
+    field: str
+    value: Scalar
+
+
+class MaterialRow(TypedDict):
+    pos: Scalar
+    description: Scalar
+    material: Scalar
+    note: NotRequired[Scalar]
+
+
+class Table1Response(TypedDict):
+    table1: list[DimensionRow]
+
+
+class Table2Response(TypedDict):
+    table2: list[MaterialRow]
+
+
+class Table3Response(TypedDict):
+    table3: list[dict[str, Scalar]]
+
+
+# Таблицы чертежа: фрагмент страницы (left, top, right, bottom в долях
+# ширины/высоты, с перекрытием - чтобы таблица не обрезалась на границе),
+# промпт, max_tokens ответа (table2 - 40+ строк) и схема ответа (объект
+# {"tableN": [...]} или голый список строк)
+DRAWING_TABLES = {
+    "table1": (
+        (0.6, 0.0, 1.0, 0.2),
+        TABLE1_PROMPT,
+        1000,
+        Union[Table1Response, list[DimensionRow]],
+    ),
+    "table2": (
+        (0.6, 0.1, 1.0, 0.9),
+        TABLE2_PROMPT,
+        4096,
+        Union[Table2Response, list[MaterialRow]],
+    ),
+    "table3": (
+        (0.55, 0.85, 1.0, 1.0),
+        TABLE3_PROMPT,
+        1000,
+        Union[Table3Response, list[dict[str, Scalar]]],
+    ),
+}
+
+
+# Клиент sync-обёрток на время одного asyncio.run (см. run_with_client)
+RUN_CLIENT = contextvars.ContextVar("RUN_CLIENT", default=None)
+
+
+def get_async_client(api_key):
+    """
+    Возвращает AsyncAnthropic клиент для текущего запроса
+
+    Клиент держит пул соединений httpx - повторные запросы не делают
+    заново TCP/TLS handshake. Пул привязан к loop, в котором создан:
+    в API (один loop на процесс) используется общий клиент процесса,
+    а sync-обёртки (новый loop на каждый asyncio.run) создают свой клиент
+    на время запуска и закрывают его (run_with_client)
+
+    Args:
+        api_key: Claude API ключ
+
+    Returns:
+        anthropic.AsyncAnthropic
+    """
+
+    client = RUN_CLIENT.get()
+
+    if client is not None:
+        return client
+
+    return cached_async_client(api_key)
+
+
+@lru_cache(maxsize=None)
+def cached_async_client(api_key):
+    """
+    Создает общий AsyncAnthropic клиент процесса (см. get_async_client)
+
+    Ключ API на процесс один, поэтому клиент не вытесняется и не остается
+    незакрытым
+    """
+
+    # max_retries=0: повторы делает ask_claude - он видит и ошибки посреди
+    # потока, которые SDK не повторяет
+    return anthropic.AsyncAnthropic(api_key=api_key, max_retries=0)
+
+
+async def run_with_client(api_key, func, *args):
+    """
+    Выполняет func(*args) со своим AsyncAnthropic клиентом (для asyncio.run)
+
+    Клиент закрывается вместе с loop, а не остается в кэше
+    """
+
+    async with anthropic.AsyncAnthropic(api_key=api_key, max_retries=0) as client:
+        # Контекст копируется в задачи gather и потоки to_thread
+        RUN_CLIENT.set(client)
+        return await func(*args)
+
+
+class ClaudeAPIError(RuntimeError):
+    """Запрос к Claude не удался после всех повторов"""
+
+
+def is_retryable_error(error):
+    """
+    Проверяет, временная ли ошибка Claude API (имеет смысл повторить)
+
+    Args:
+        error: исключение из anthropic SDK
+
+    Returns:
+        True для сетевых ошибок, 408/409/429/5xx и overloaded посреди потока
+    """
+
+    if isinstance(error, anthropic.APIConnectionError):
+        return True
+
+    if not isinstance(error, anthropic.APIStatusError):
+        return False
+
+    if error.status_code in (408, 409, 429) or error.status_code >= 500:
+        return True
+
+    # Ошибка посреди потока: {"type": "error", "error": {"type": "..."}}
+    body = error.body if isinstance(error.body, dict) else {}
+    details = body.get("error")
+    return isinstance(details, dict) and details.get("type") in RETRYABLE_STREAM_ERRORS
+
+
+def retry_delay(error, attempt):
+    """
+    Задержка перед повтором: retry-after от API или экспонента с jitter
+
+    Args:
+        error: исключение из anthropic SDK
+        attempt: номер неудачной попытки (с 0)
+
+    Returns:
+        float: секунды
+    """
+
+    response = getattr(error, "response", None)
+
+    if response is not None:
+        try:
+            return min(float(response.headers["retry-after"]), API_RETRY_MAX_DELAY)
+        except (KeyError, ValueError):
+            pass
+
+    delay = min(API_RETRY_BASE_DELAY * 2**attempt, API_RETRY_MAX_DELAY)
+    return delay * random.uniform(0.5, 1.0)
+
+
+async def ask_claude(api_key, img_base64, media_type, prompt, max_tokens):
+    """
+    Отправляет изображение с промптом в Claude и возвращает текст ответа
+
+    Ответ читается потоком (messages.stream): длинный ответ не упирается
+    в таймаут обычного (не потокового) запроса. Временные ошибки (429, 5xx,
+    overloaded, сеть) повторяются с экспоненциальной задержкой - рендер и
+    кодирование изображения при этом не повторяются
+
+    Args:
+        api_key: Claude API ключ
+        img_base64: изображение в base64
+        media_type: "image/png" или "image/jpeg"
+        prompt: текст промпта
+        max_tokens: лимит токенов ответа
+
+    Returns:
+        str: текст ответа
+
+    Raises:
+        ClaudeAPIError: запрос не удался после API_MAX_RETRIES повторов
+    """
+
+    for attempt in range(API_MAX_RETRIES + 1):
+        try:
+            return await stream_claude_text(
+                api_key, img_base64, media_type, prompt, max_tokens
+            )
+        except anthropic.APIError as error:
+            if not is_retryable_error(error):
+                raise
+
+            if attempt == API_MAX_RETRIES:
+                raise ClaudeAPIError(
+                    f"Claude API недоступен после {API_MAX_RETRIES} повторов: {error}"
+                ) from error
+
+            delay = retry_delay(error, attempt)
+            print(f"⚠️  Ошибка Claude API ({error}), повтор через {delay:.1f} с...")
+            await asyncio.sleep(delay)
+
+
+async def stream_claude_text(api_key, img_base64, media_type, prompt, max_tokens):
+    """
+    Один потоковый запрос к Claude (без повторов, см. ask_claude)
 
-    print("🔄 Отправляю запрос в Claude API...")
-    client = anthropic.Anthropic(api_key=api_key)
+    Returns:
+        str: текст ответа
+    """
 
-    response = client.messages.create(
-        model="claude-sonnet-4-20250514",
-        max_tokens=4096,  # Увеличили для длинного ответа
+    client = get_async_client(api_key)
+
+    async with client.messages.stream(
+        model=CLAUDE_MODEL,
+        max_tokens=max_tokens,
         messages=[
             {
                 "role": "user",
@@ -271,7 +492,7 @@ IMPORTANT REMINDERS:
                         "type": "image",
                         "source": {
                             "type": "base64",
-                            "media_type": "image/png",
+                            "media_type": media_type,
                             "data": img_base64,
                         },
                     },
@@ -279,46 +500,417 @@ IMPORTANT REMINDERS:
                 ],
             }
         ],
-    )
+    ) as stream:
+        return await stream.get_final_text()
+
+
+def claude_cache_key(img_base64, media_type, prompt, max_tokens):
+    """
+    Ключ кэша ответа Claude: SHA-256 всего, что определяет запрос
 
-    print("🔄 Обработка ответа...")
-    response_text = response.content[0].text
+    Returns:
+        hex digest
+    """
 
-    response_text = re.sub(r"```json\s*", "", response_text)
-    response_text = re.sub(r"```\s*", "", response_text)
-    response_text = response_text.strip()
+    digest = hashlib.sha256()
 
-    result = json.loads(response_text)
-    result = fix_encoding(result)
+    for part in (CLAUDE_MODEL, str(max_tokens), media_type, prompt):
+        digest.update(part.encode())
+        digest.update(b"\0")
 
-    print("✅ Парсинг завершён!")
+    digest.update(img_base64.encode())
+    return digest.hexdigest()
+
+
+def get_cached_response(key):
+    """
+    Возвращает закэшированный разобранный ответ Claude или None
+
+    Args:
+        key: результат claude_cache_key
+    """
+
+    return read_cache_entry(f"claude_{key}.json")
+
+
+def set_cached_response(key, result):
+    """
+    Сохраняет разобранный ответ Claude в кэш и чистит кэш от просроченных
+    и лишних записей
+
+    Args:
+        key: результат claude_cache_key
+        result: разобранный JSON ответа
+    """
+
+    write_cache_entry(f"claude_{key}.json", result)
+
+
+async def ask_claude_json(
+    api_key, img_base64, media_type, prompt, max_tokens, response_type
+):
+    """
+    Запрос к Claude с разбором и проверкой JSON ответа (с кэшем на диске)
+
+    Повторный запрос с тем же изображением и промптом не идет в API
+    (кэш ответа на одну таблицу - нижний уровень кэша, см. disk_cache)
+
+    Args:
+        response_type: схема ответа для msgspec (TypedDict / list[...])
+        остальные - см. ask_claude
+
+    Returns:
+        разобранный JSON ответа (dict / list)
+
+    Raises:
+        msgspec.ValidationError: ответ не соответствует схеме
+    """
+
+    key = claude_cache_key(img_base64, media_type, prompt, max_tokens)
+    # Файловый ввод-вывод кэша - в отдельном потоке, не в event loop
+    result = await asyncio.to_thread(get_cached_response, key)
+
+    if result is not None:
+        print("✅ Ответ Claude взят из кэша")
+        return result
+
+    response_text = await ask_claude(
+        api_key, img_base64, media_type, prompt, max_tokens
+    )
+
+    # Очищаем от markdown
+    response_text = FENCE_RE.sub("", response_text).strip()
+
+    # response_text уже str (SDK декодирует UTF-8) - перекодировка не нужна;
+    # msgspec разбирает JSON и сразу проверяет схему за один проход
+    # (TypedDict -> обычный dict, числа в полях Scalar -> str)
+    try:
+        result = msgspec.json.decode(
+            response_text, type=response_type, dec_hook=text_dec_hook
+        )
+    except msgspec.DecodeError:
+        # Сырой ответ нужен для разбора ошибки - исключение его не содержит
+        print(f"❌ Ответ Claude не разобран:\n{response_text}")
+        raise
+
+    # В кэш попадает только ответ, который разобрался без ошибок
+    await asyncio.to_thread(set_cached_response, key, result)
     return result
 
 
-def fix_encoding(result):
-    """Исправляет ТОЛЬКО технические проблемы кодировки UTF-8"""
+def encode_image_base64(
+    image, max_pixels=None, image_format="PNG", max_side=VISION_MAX_SIDE, box=None
+):
+    """
+    Кодирует изображение (или его фрагмент) в base64 для запроса к Claude
 
-    # Фикс символа Ø в table1 (это баг кодировки, не данные)
-    if "table1" in result:
-        fixed_table1 = []
-        for item in result["table1"]:
-            fixed_item = {}
-            for key, value in item.items():
-                # Исправляем битые UTF-8 символы в ключе (field)
-                if "Ã˜" in str(key) or "Ã" in str(key):
-                    fixed_key = str(key).replace("Ã˜", "Ø").replace("Ã", "")
-                else:
-                    fixed_key = key
+    Args:
+        image: PIL изображение
+        max_pixels: если задан, изображение большего размера уменьшается
+            (Lanczos, с сохранением пропорций)
+        image_format: "PNG" (без потерь) или "JPEG"
+        max_side: ограничение длинной стороны (так же уменьшается)
+        box: фрагмент (left, top, right, bottom) в пикселях; None - целиком
+
+    Returns:
+        str: изображение в base64
+    """
 
-                fixed_item[fixed_key] = value
+    if box is None:
+        box = (0, 0, image.width, image.height)
 
-            fixed_table1.append(fixed_item)
+    width = box[2] - box[0]
+    height = box[3] - box[1]
+    scale = 1.0
 
-        result["table1"] = fixed_table1
+    if max_pixels and width * height > max_pixels:
+        scale = math.sqrt(max_pixels / (width * height))
 
+    if max_side:
+        scale = min(scale, max_side / max(width, height))
+
+    if scale < 1.0:
+        # resize(box=...) читает фрагмент прямо из страницы - без
+        # промежуточной копии, которую создал бы crop()
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        image = image.resize(size, Image.Resampling.LANCZOS, box=box)
+    elif box != (0, 0, image.width, image.height):
+        image = image.crop(box)
+
+    buffered = BytesIO()
+
+    if image_format == "JPEG":
+        # subsampling=0: без цветового субсэмплинга тонкие линии не размываются
+        image.save(buffered, format="JPEG", quality=JPEG_QUALITY, subsampling=0)
+    else:
+        # compress_level=1: PNG остается без потерь, но кодируется быстрее
+        image.save(buffered, format="PNG", compress_level=1)
+
+    # getbuffer(): base64 читает буфер напрямую, без копии как у getvalue()
+    return base64.b64encode(buffered.getbuffer()).decode("ascii")
+
+
+def render_first_page(pdf_path, dpi=PAGE_DPI):
+    """
+    Рендерит первую страницу PDF через PyMuPDF
+
+    Вызывается один раз на запрос (parse_all_async / parse_drawing_pdf_ai_async),
+    фрагменты для Claude режутся из этого изображения
+
+    Глобального кэша рендеров нет: API сохраняет каждую загрузку в новый
+    temp файл, поэтому кэш по пути не попадает между запросами, а только
+    держит в памяти страницы по ~50 MB (RGB A3 при 300 DPI)
+
+    Args:
+        pdf_path: путь к PDF файлу
+        dpi: разрешение рендера
+
+    Returns:
+        PIL изображение страницы
+    """
+
+    print(f"🔄 Конвертирую PDF в изображение (DPI {dpi})...")
+    # PyMuPDF рендерит в памяти процесса - без запуска pdftoppm и временных
+    # файлов, как было с pdf2image
+    with pymupdf.open(pdf_path) as doc:
+        pixmap = doc[0].get_pixmap(dpi=dpi, alpha=False)
+
+    return Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+
+
+def render_technical_params_base64(full_image):
+    """
+    Вырезает bottom-left зону с техническими параметрами и кодирует в base64
+
+    Args:
+        full_image: PIL изображение страницы (render_first_page)
+
+    Returns:
+        str: PNG в base64
+    """
+
+    # Вырезаем bottom-left зону (где находятся технические параметры)
+    width, height = full_image.size
+    left = 0
+    top = int(height * 0.65)  # Нижние 35%
+    right = int(width * 0.35)  # Левые 35%
+    bottom = height
+
+    # Уменьшаем до бюджета Claude и конвертируем в base64
+    return encode_image_base64(
+        full_image,
+        VISION_MAX_PIXELS,
+        max_side=TECH_PARAMS_MAX_SIDE,
+        box=(left, top, right, bottom),
+    )
+
+
+def parse_technical_params(pdf_path, api_key):
+    """
+    Парсит ТОЛЬКО технические параметры из bottom-left зоны чертежа
+    (синхронная обёртка)
+
+    Returns:
+        dict: {
+            "DESIGN_TEMP": "...",
+            "DESIGN_PRESSURE": "...",
+            "PRESSURE_TEST_BODY": "...",
+            "PRESSURE_TEST_SEAT": "..."
+        }
+    """
+
+    return asyncio.run(
+        run_with_client(api_key, parse_technical_params_async, pdf_path, api_key)
+    )
+
+
+async def parse_technical_params_async(pdf_path, api_key, page_image=None):
+    """
+    Парсит ТОЛЬКО технические параметры из bottom-left зоны чертежа
+    (AsyncAnthropic)
+
+    Args:
+        pdf_path: путь к PDF файлу
+        api_key: Claude API ключ
+        page_image: уже отрендеренная страница; None - рендерится здесь
+
+    Returns:
+        dict: {
+            "DESIGN_TEMP": "...",
+            "DESIGN_PRESSURE": "...",
+            "PRESSURE_TEST_BODY": "...",
+            "PRESSURE_TEST_SEAT": "..."
+        }
+    """
+
+    print("🔄 Извлекаю технические параметры из bottom-left зоны...")
+
+    if page_image is None:
+        page_image = await asyncio.to_thread(render_first_page, pdf_path)
+
+    img_base64 = await asyncio.to_thread(render_technical_params_base64, page_image)
+
+    # Отправляем в Claude API
+    result = await ask_claude_json(
+        api_key,
+        img_base64,
+        "image/png",
+        TECH_PARAMS_PROMPT,
+        max_tokens=1000,
+        response_type=TechnicalParams,
+    )
+
+    print("✅ Технические параметры извлечены!")
     return result
 
 
+def render_region_base64(full_image, box):
+    """
+    Вырезает фрагмент страницы, уменьшает до VISION_MAX_PIXELS
+    и кодирует в JPEG base64
+
+    Args:
+        full_image: PIL изображение страницы (render_first_page)
+        box: (left, top, right, bottom) в долях ширины/высоты страницы
+
+    Returns:
+        str: JPEG в base64
+    """
+
+    width, height = full_image.size
+    left, top, right, bottom = box
+    region = (
+        int(width * left),
+        int(height * top),
+        int(width * right),
+        int(height * bottom),
+    )
+
+    return encode_image_base64(full_image, VISION_MAX_PIXELS, "JPEG", box=region)
+
+
+def parse_drawing_pdf_ai(pdf_path, api_key):
+    """
+    Парсит PDF чертеж через Claude API (синхронная обёртка)
+
+    Args:
+        pdf_path: путь к PDF файлу
+        api_key: Claude API ключ
+
+    Returns:
+        dict: {table1: [...], table2: [...], table3: [...]}
+    """
+
+    return asyncio.run(
+        run_with_client(api_key, parse_drawing_pdf_ai_async, pdf_path, api_key)
+    )
+
+
+async def parse_drawing_pdf_ai_async(pdf_path, api_key, page_image=None):
+    """
+    Парсит PDF чертеж через Claude API (AsyncAnthropic)
+
+    Рендер PDF выполняется в отдельном потоке, запрос к API - через await,
+    поэтому event loop не блокируется. Каждая таблица распознается своим
+    запросом по своему фрагменту страницы (DRAWING_TABLES), запросы идут
+    параллельно.
+
+    Args:
+        pdf_path: путь к PDF файлу
+        api_key: Claude API ключ
+        page_image: уже отрендеренная страница; None - рендерится здесь
+
+    Returns:
+        dict: {table1: [...], table2: [...], table3: [...]}
+    """
+
+    # Страница рендерится один раз, фрагменты таблиц режутся из нее
+    if page_image is None:
+        page_image = await asyncio.to_thread(render_first_page, pdf_path)
+
+    print("🔄 Отправляю запросы в Claude API (по таблицам)...")
+    tables = await asyncio.gather(
+        *(parse_drawing_table(page_image, api_key, table) for table in DRAWING_TABLES)
+    )
+
+    print("✅ Парсинг завершён!")
+    return dict(zip(DRAWING_TABLES, tables))
+
+
+async def parse_drawing_table(page_image, api_key, table):
+    """
+    Распознает одну таблицу чертежа по ее фрагменту страницы
+
+    Args:
+        page_image: PIL изображение страницы (render_first_page)
+        api_key: Claude API ключ
+        table: ключ DRAWING_TABLES ("table1", "table2", "table3")
+
+    Returns:
+        list: строки таблицы
+    """
+
+    box, prompt, max_tokens, response_type = DRAWING_TABLES[table]
+
+    img_base64 = await asyncio.to_thread(render_region_base64, page_image, box)
+
+    result = await ask_claude_json(
+        api_key,
+        img_base64,
+        "image/jpeg",
+        prompt,
+        max_tokens=max_tokens,
+        response_type=response_type,
+    )
+
+    # Ответ - {"tableN": [...]}; голый список тоже принимаем
+    if isinstance(result, list):
+        return result
+
+    return result.get(table, [])
+
+
+def parse_all(pdf_path, api_key):
+    """
+    Парсит чертеж и технические параметры (синхронная обёртка)
+
+    Args:
+        pdf_path: путь к PDF файлу
+        api_key: Claude API ключ
+
+    Returns:
+        tuple: (результат parse_drawing_pdf_ai, результат parse_technical_params)
+    """
+
+    return asyncio.run(run_with_client(api_key, parse_all_async, pdf_path, api_key))
+
+
+async def parse_all_async(pdf_path, api_key):
+    """
+    Парсит чертеж и технические параметры параллельно
+
+    Запросы к Claude независимы, поэтому общее время - самый долгий из
+    них, а не сумма
+
+    Args:
+        pdf_path: путь к PDF файлу
+        api_key: Claude API ключ
+
+    Returns:
+        tuple: (результат parse_drawing_pdf_ai, результат parse_technical_params)
+    """
+
+    # Страница рендерится один раз и общая для обоих парсеров
+    page_image = await asyncio.to_thread(render_first_page, pdf_path)
+
+    drawing, technical_params = await asyncio.gather(
+        parse_drawing_pdf_ai_async(pdf_path, api_key, page_image),
+        parse_technical_params_async(pdf_path, api_key, page_image),
+    )
+
+    return drawing, technical_params
+
+
 if __name__ == "__main__":
     API_KEY = os.getenv("ANTHROPIC_API_KEY")
 
@@ -330,10 +922,12 @@ if __name__ == "__main__":
         print("\n" + "=" * 60)
         print("📊 РЕЗУЛЬТАТ ПАРСИНГА:")
         print("=" * 60)
-        print(json.dumps(result, indent=2, ensure_ascii=False))
+        # orjson пишет UTF-8 без экранирования (как ensure_ascii=False)
+        result_json = orjson.dumps(result, option=orjson.OPT_INDENT_2)
+        print(result_json.decode())
 
-        with open("parsed_result_ai.json", "w", encoding="utf-8") as f:
-            json.dump(result, f, indent=2, ensure_ascii=False)
+        with open("parsed_result_ai.json", "wb") as f:
+            f.write(result_json)
 
         print("\n💾 Результат сохранён в parsed_result_ai.json")
 
@@ -369,9 +963,12 @@ if __name__ == "__main__":
                 else:
                     print(f"  ❌ Pos {pos}: НЕ НАЙДЕН!")
 
-    except json.JSONDecodeError as e:
+    except msgspec.DecodeError as e:
+        # Сам ответ Claude уже выведен в ask_claude_json
         print(f"❌ Ошибка парсинга JSON: {e}")
-        print(f"Ответ Claude:\n{response_text}")
+    except ClaudeAPIError as e:
+        print(f"❌ {e}")
+        print("💾 Успешные ответы уже в кэше - повторный запуск их не повторит")
     except Exception as e:
         print(f"❌ Ошибка: {e}")
         import traceback